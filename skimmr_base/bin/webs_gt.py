@@ -31,7 +31,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys, os, BaseHTTPServer, SocketServer, cgi, urlparse, tempfile, re,\
-  hashlib, threading, datetime, shutil, urllib, traceback, time
+  hashlib, threading, datetime, shutil, urllib, traceback, time, json
 # just for testing purposes
 TEST = True # change to false if not in the development version
 LIB_PATH = '/home/vitnov/Work/devel/eureeka-lite/skimmr_base/lib'
@@ -99,11 +99,39 @@ class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     # getting the JSON representation of the result (statements or provenances)
     return query_res.generate_json(res_type=res_type)
 
+  def send_completions(self,pdict):
+    # sending the JSON list of the most frequent lexicon terms completing the
+    # prefix given by the 'prefix' parameter (at most 'k' of them)
+    prefix, k = '', 10
+    if 'prefix' in pdict:
+      prefix = pdict['prefix'][0]
+    if 'k' in pdict:
+      try:
+        k = int(pdict['k'][0])
+      except ValueError:
+        sys.stderr.write('W@send_completions(): invalid size request: '+\
+          pdict['k'][0]+'\n')
+    if INDEX is None:
+      # the index could not be loaded
+      status, body = 503, {'error':'index not loaded'}
+    else:
+      status = 200
+      body = [{'term':x,'freq':y} for x, y in INDEX.complete(prefix,k)]
+    self.send_response(status)
+    self.send_header('Content-type','application/json')
+    self.end_headers()
+    self.wfile.write(json.dumps(body))
+
   def do_GET(self):
     # process GET requests
 
     # getting the dictionary with the input params
-    pdict = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+    url = urlparse.urlsplit(self.path)
+    pdict = urlparse.parse_qs(url.query)
+    if url.path == '/complete':
+      # term completion request
+      self.send_completions(pdict)
+      return
     # setting the default parameter values
     query_string, res_type = '', 'stmt'
     maxn, maxe = 50, 200
@@ -27,15 +27,17 @@ import sys, os, whoosh, time, xml, json, gzip, pydot, BaseHTTPServer
 import networkx as nx
 from networkx.readwrite import json_graph
 from xml.etree.ElementTree import fromstring
-from itertools import combinations
+from itertools import combinations, groupby
+from heapq import merge
+from operator import itemgetter
 from math import log
 from whoosh.qparser import QueryParser
 from whoosh.index import open_dir, create_in
 from whoosh.fields import Schema, TEXT, ID
 from whoosh.analysis import StemmingAnalyzer
 import util
-from util import FuzzySet, norm_np, Tensor
-from strg import Lexicon
+from util import FuzzySet, norm_np, precompute_norm_np, Tensor
+from strg import Lexicon, MappedLexicon, PrefixIndex, store_file
 
 # the key word for the universe variable
 UNIVERSE_TERM = '__UNIVERSE__'
@@ -888,7 +890,11 @@ class MemStoreIndex:
   Wrapper for indexing and querying of the MemStore pre-computed instances.
   """
 
-  def __init__(self,store_path,trace=False,log_filename=None):
+  def __init__(self,store_path,trace=False,log_filename=None,\
+  precompute_norms=False):
+    # if precompute_norms is True, the normalised forms of all the lexicon
+    # expressions are precomputed for the query term processing (see 
+    # util.precompute_norm_np())
     start_all = time.time()
     # setting up the trace and logging related stuff
     self.trace = trace
@@ -926,8 +932,18 @@ class MemStoreIndex:
     # generating the universe set
     print '- generating the lexical universe set'
     start = time.time()
-    self.universe = FuzzySet([(x,1.0) for x in self.lexicon.int2lex.keys()])
+    self.universe = FuzzySet([(x,1.0) for x in self.lexicon.ids()])
     print '  ... generated in', time.time() - start, 'seconds'
+    # the prefix index for the term completion
+    print '- generating the lexicon prefix index'
+    start = time.time()
+    self.prefixes = PrefixIndex(self.lexicon)
+    print '  ... generated in', time.time() - start, 'seconds'
+    if precompute_norms:
+      print '- precomputing the normalised lexicon expressions'
+      start = time.time()
+      precompute_norm_np([self.lexicon[x] for x in self.lexicon.ids()])
+      print '  ... precomputed in', time.time() - start, 'seconds'
     # the dictionary mapping types to their instances
     print '- loading the types/instances index'
     start = time.time()
@@ -992,14 +1008,20 @@ class MemStoreIndex:
     return puid2meta
 
   def _load_lexicon(self):
+    # memory-mapping the binary lexicon if present and up to date (see 
+    # strg.store_file()), parsing the tab-separated value one (and freezing 
+    # it, see Lexicon.freeze()) otherwise
     lexicon = Lexicon()
-    if os.path.exists(os.path.join(self.store_path,'lexicon.tsv.gz')):
-      lex_fn = os.path.join(self.store_path,'lexicon.tsv.gz')
+    lex_fn = lex_path(self.store_path)
+    if not os.path.exists(lex_fn):
+      sys.stderr.write('\nW @ MemStoreIndex() - lexicon cannot be loaded!\n')
+    elif lex_fn.endswith('.bin'):
+      lexicon = MappedLexicon(lex_fn,interned=True)
+    else:
       lex_f = gzip.open(lex_fn,'rb')
       lexicon.from_file(lex_f)
       lex_f.close()
-    else:
-      sys.stderr.write('\nW @ MemStoreIndex() - lexicon cannot be loaded!\n')
+      lexicon = lexicon.freeze()
     return lexicon
 
   def _load_types2instances(self):
@@ -1107,6 +1129,16 @@ class MemStoreIndex:
         id_set |= self.types2instances[identifier]
     return list(id_set)
 
+  def complete(self,prefix,k=10):
+    """
+    Returns a list of at most k (expression, frequency) tuples of the most
+    frequent lexicon expressions completing the prefix (only lower-cased, 
+    as the full normalisation does not apply to incomplete words).
+    """
+
+    return [(self.lexicon[x],freq) for x, freq in \
+      self.prefixes.complete(prefix.lower().lstrip(),k)]
+
   def parse_xml_query(self,xml,fname):
     # parses the query in XML (string or file) and returns a query object 
 
@@ -1233,28 +1265,45 @@ def update_index(ix,text2index):
   writer.commit()
 
 def load_lex(fname):
-  # loading the lexicon
+  # loading the lexicon, either memory-mapping a binary (.bin) file or parsing
+  # a gzipped tab-separated value one
+  if fname.endswith('.bin'):
+    return MappedLexicon(fname)
   l = Lexicon()
   f = gzip.open(fname,'rb')
   l.from_file(f)
   f.close()
   return l
 
+def load_tensor(fname,rank):
+  # loading a tensor, either memory-mapping a binary (.bin) file or parsing
+  # a gzipped tab-separated value one
+  t = Tensor(rank=rank)
+  if fname.endswith('.bin'):
+    t.from_bin(fname)
+  else:
+    f = gzip.open(fname,'rb')
+    t.from_file(f)
+    f.close()
+  return t
+
+def lex_path(store_path):
+  # path to the store lexicon file, preferring the binary version if present
+  # and up to date (see strg.store_file())
+  return store_file(store_path,'lexicon')
+
+def tensor_path(store_path,name):
+  # path to a store tensor file, preferring the binary version if present
+  # and up to date (see strg.store_file())
+  return store_file(store_path,name)
+
 def load_corpus(fname):
-  # loading the lexicon
-  c = Tensor(rank=3)
-  f = gzip.open(fname,'rb')
-  c.from_file(f)
-  f.close()
-  return c
+  # loading the corpus
+  return load_tensor(fname,3)
 
 def load_src(fname):
-  # loading the lexicon
-  src = Tensor(rank=4)
-  f = gzip.open(fname,'rb')
-  src.from_file(f)
-  f.close()
-  return src
+  # loading the sources
+  return load_tensor(fname,4)
 
 def load_suids(fname):
   # load the mapping of the statements to their IDs
@@ -1270,26 +1319,56 @@ def gen_cooc_suid2puid(sources,stmt2suid):
   # generating the mapping from extracted statements to provenances and their
   # weights
   dct = {}
-  for s, p, o, prov in sources:
-    w = sources[(s,p,o,prov)]
+  for (s, p, o, prov), w in sources.iteritems():
     suid = stmt2suid[(s,p,o)][0]
     if not suid in dct:
       dct[suid] = []
     dct[suid].append((prov,w))
   return dct
 
-def gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id):
+def gen_termsets(corpus):
+  # generating the (term,related term,weight) tuples of the term sets from 
+  # the corpus in one streaming pass - the subject and object fibers of the
+  # corpus are merged by the terms, so that all the (object,weight) and 
+  # (subject,weight) tuples related to a term are collected at once
+  fibers = merge(((t,0,x) for t, x in corpus.fibers(0)),\
+    ((t,2,x) for t, x in corpus.fibers(2)))
+  for term, group in groupby(fibers,itemgetter(0)):
+    rel_set = set()
+    for t, dim, entries in group:
+      for (s,p,o), w in entries:
+        if dim == 0:
+          rel_set.add((o,w))
+        else:
+          rel_set.add((s,w))
+    for t2, w in rel_set:
+      yield term, t2, w
+
+def gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id,corpus=None):
   # process the stmt2suid, creating the dictionary mapping subjects to 
   # (predicate,object) tuples, and also generating a list of similarity
   # relationship statements together with their SUIDs and weights
-  print '  - building the auxiliary dictionaries'
-  s2po, sim_stmts = {}, {}
-  for s,p,o in stmt2suid:
-    if not s in s2po:
-      s2po[s] = set()
-    s2po[s].add((p,o))
-    if p == simrel_id:
-      sim_stmts[(s,o)] = stmt2suid[(s,p,o)]
+  # if the corpus is given, the similarity statements are taken from its 
+  # slice instead, and the (predicate,object) tuples only of the similar 
+  # terms are collected in one pass over the corpus fibers
+  if corpus is None:
+    print '  - building the auxiliary dictionaries'
+    s2po, sim_stmts = {}, {}
+    for s,p,o in stmt2suid:
+      if not s in s2po:
+        s2po[s] = set()
+      s2po[s].add((p,o))
+      if p == simrel_id:
+        sim_stmts[(s,o)] = stmt2suid[(s,p,o)]
+    get_po = s2po.__getitem__
+  else:
+    print '  - getting the similarity statements from the corpus'
+    sim_stmts = dict([((s,o),stmt2suid[(s,p,o)]) for (s,p,o), w in \
+      corpus.slice(1,simrel_id)])
+    terms = set([x for pair in sim_stmts for x in pair])
+    s2po = dict([(s,set([(p,o) for (x,p,o), w in entries])) for s, entries \
+      in corpus.fibers(0) if s in terms])
+    get_po = lambda x: s2po.get(x,set())
   # process all the similarity statements, determining the co-occurrence
   # statements that led to them as an intersection of the (predicate,object)
   # tuple sets corresponding to the similar arguments
@@ -1301,7 +1380,7 @@ def gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id):
     sim_suid, sim_w = sim_stmts[(s,o)]
     puid2weight = {}
     # processing the shared statements
-    for p_prov, o_prov in s2po[s] & s2po[o]:
+    for p_prov, o_prov in get_po(s) & get_po(o):
       prov_suid1 = stmt2suid[(s, p_prov, o_prov)][0]
       prov_suid2 = stmt2suid[(o, p_prov, o_prov)][0]
       l = []
@@ -1330,9 +1409,9 @@ if __name__ == "__main__":
   store_path = os.getcwd()
   if len(sys.argv) > 1:
     store_path = os.path.abspath(sys.argv[1])
-  lexicon_path = os.path.join(store_path,'lexicon.tsv.gz')
-  sources_path = os.path.join(store_path,'sources.tsv.gz')
-  corpus_path = os.path.join(store_path,'corpus.tsv.gz')
+  lexicon_path = lex_path(store_path)
+  sources_path = tensor_path(store_path,'sources')
+  corpus_path = tensor_path(store_path,'corpus')
   index_path = os.path.join(store_path,'index')
   fulltext_path = os.path.join(store_path,'index','fulltext')
   if not os.path.exists(index_path):
@@ -1358,29 +1437,20 @@ if __name__ == "__main__":
   print '*** Creating the corpus indices'
   print '  ... loading the corpus from:', corpus_path
   corpus = load_corpus(corpus_path)
-  i, suid_lines, term_dict = 0, [], {}
+  i, suid_lines = 0, []
   print '  ... generating the CSV representations from the corpus'
   for (s,p,o), w in corpus.items():
     # updating the lines of the SUID CSV
     suid_lines.append('\t'.join([str(x) for x in [i,s,p,o,w]]))
     i += 1
-    # updating the TERM CSV dictionary
-    if not s in term_dict:
-      term_dict[s] = set()
-    if not o in term_dict:
-      term_dict[o] = set()
-    term_dict[s].add((o,w))
-    term_dict[o].add((s,w))
   print '  ... storing the CSV file:', os.path.join(index_path,'suids.tsv.gz')
   f = gzip.open(os.path.join(index_path,'suids.tsv.gz'),'wb')
   f.write('\n'.join(suid_lines))
   f.close()
   print '  ... storing the CSV file:', \
     os.path.join(index_path,'termsets.tsv.gz')
-  term_lines = []
-  for t1, rel_set in term_dict.items():
-    for t2, w in rel_set:
-      term_lines.append('\t'.join([str(x) for x in [t1,t2,w]]))
+  # streaming the term sets from the corpus fibers
+  term_lines = ['\t'.join([str(x) for x in y]) for y in gen_termsets(corpus)]
   f = gzip.open(os.path.join(index_path,'termsets.tsv.gz'),'wb')
   f.write('\n'.join(term_lines))
   f.close()
@@ -1403,7 +1473,8 @@ if __name__ == "__main__":
   f_out.write('\n'.join(lines))
   print '  ... generating/storing the SUID->PUID mapping for sim. statements'
   simrel_id = lexicon['related_to']
-  missing, processed = gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id)
+  missing, processed = gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id,\
+    corpus)
   print '  ... finished'
   print '  - missing sim. provenance info     :', missing
   print '  - generated sim. provenance entries:', processed
@@ -22,6 +22,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import math
+from itertools import izip
 
 class Analyser:
   """
@@ -43,25 +44,15 @@ class Analyser:
     #self.max_bulk = store.max_bulk
     # the type of the perspective to be analysed by this class
     self.ptype = ptype
-    # the matrix handler of the perspective, computed from scratch by default
+    # the CSR matrix of the perspective, computed from scratch by default
     self.matrix = self.store.perspectives[self.ptype]
     if compute:
       self.matrix = self.store.computePerspective(self.ptype)
-    self.sparse = None
-    self.rmaps = None
-    self.cmaps = None
-    self.col2row = None
-    # get an in-memory representation of the matrix
-    if mem:
+    # get the column to row index of the matrix
+    if mem and self.matrix.csc == None:
       if self.trace:
-        print 'DEBUG - getting the sparse in-memory matrix'
-      self.sparse, self.col2row = self.matrix.getSparseDict()
-      # @TODO - possibly get back to the SciPy sparse if necessary
-      #self.sparse, self.rmaps, self.cmaps = self.matrix.getSparse('CSR')
-      #if self.trace:
-      #  print 'DEBUG - finished - now computing the similar stuff'
-      #  print 'DEBUG - sparse dimensions :', self.sparse.shape
-      #  print 'DEBUG - size of the matrix:', len(self.matrix)
+        print 'DEBUG - computing the column index of the matrix'
+      self.matrix.index()
 
   def __del__(self):
     """
@@ -88,22 +79,25 @@ class Analyser:
     their IDs) to the statements that were used for computing their similarity.
     """
     
-    # @NOTE - an implementation that makes use of a simple dictionary-based 
-    #         sparse matrix representation and corresponding column to row 
-    #         index
+    # @NOTE - an implementation that makes use of the CSR matrix of the 
+    #         perspective and its column to row index (the rows and columns
+    #         are processed as their integer IDs within the matrix)
 
     entity_id = entity
     if isinstance(entity_id,str) or isinstance(entity_id,unicode):
       entity_id = self.store.convert((entity,))[0]
-    if entity_id == None or not entity_id in self.sparse:
+    if entity_id == None or not entity_id in self.matrix:
       return []
-    # the row vector of the sparse matrix (a column_index:weight dictionary)
-    row = self.sparse[entity_id]
+    if self.matrix.csc == None:
+      self.matrix.index()
+    # the row vector of the sparse matrix (a column ID:weight dictionary)
+    entity_rid = self.matrix.row_ids[entity_id]
+    row = dict(izip(*self.matrix.getrow(entity_rid)))
     un = math.sqrt(sum([row[x]**2 for x in row]))
     # getting promising vectors for the similarity computation
     promising = set()
     for col in row:
-      promising |= self.col2row[col]
+      promising.update(self.matrix.csc.getrow(col)[0])
     if self.trace:
       print 'DEBUG@similarTo() - entity vector size        :', len(row)
       print 'DEBUG@similarTo() - number of possibly similar:', len(promising)
@@ -114,25 +108,26 @@ class Analyser:
     #sim_vec, sims2src = [], {}
     sim_vec = []
     # going through all promising rows in the sparse matrix representation
-    for v_id in promising:
-      if v_id == entity_id:
+    for v_rid in promising:
+      if v_rid == entity_rid:
         # don't process the same entity as similar
         continue
+      v_id = self.matrix.rows[v_rid]
       # container for statements that lead to particular similarities
       statements_used = set()
-      compared_row = self.sparse[v_id]
       # computing the actual similarity
       uv, vn = 0.0, 0.0
-      for x in compared_row:
+      for x, w in izip(*self.matrix.getrow(v_rid)):
         if x in row:
-          tmp = row[x]*compared_row[x]
+          tmp = row[x]*w
           uv += tmp
           # updating the statements used information
           if self.ptype == 'LAxLIRA':
-            statements_used.add((entity_id,x[0],x[1]))
-            statements_used.add((v_id,x[0],x[1]))
+            p, o = self.matrix.cols[x]
+            statements_used.add((entity_id,p,o))
+            statements_used.add((v_id,p,o))
           # @TODO - implement also for other types !!!
-        vn += compared_row[x]**2
+        vn += w**2
       vn = math.sqrt(vn)
       sim = float(uv)/(un*vn)
       if math.fabs(sim) >= minsim:
@@ -7,12 +7,18 @@ Guide to execution:
 
 python crkb_kb.py [ACTION] [FOLDER1] [FOLDER2]
 
-where ACTION is one of 'create' or 'compsim' and FOLDER1, FOLDER2 are
-the input and output folders, respectively. The action 'create' creates the KB 
-representation from the statements previously stored in FOLDER1, generating
-the KB serialisation files in FOLDER2. If the action is 'compsim', the
-script loads the KB serialisation from FOLDER1, computes the semantic 
-similarities in it and stores the resulting knowledge base in FOLDER2.
+where ACTION is one of 'create', 'update' or 'compsim' and FOLDER1, FOLDER2 
+are the input and output folders, respectively. The action 'create' creates 
+the KB representation from the statements previously stored in FOLDER1, 
+generating the KB serialisation files in FOLDER2. If the action is 'update',
+the statements in FOLDER1 are added to the KB serialisation in FOLDER2, 
+updating its corpus incrementally (the semantic similarities have to be 
+computed again then). If the action is 'compsim', the script loads the KB 
+serialisation from FOLDER1, computes the semantic similarities in it and 
+stores the resulting knowledge base in FOLDER2. Along with the serialisation
+files, each action saves a binary snapshot of the whole store to FOLDER2, 
+which is then loaded by the following actions (and by the indexing script)
+instead of parsing the serialisation files.
 
 Copyright (C) 2012 Vit Novacek (vit.novacek@deri.org), Digital Enterprise
 Research Institute (DERI), National University of Ireland Galway (NUIG)
@@ -47,7 +53,7 @@ if __name__ == "__main__":
     out_path = os.path.abspath(sys.argv[3])
   # setting the paths automatically if not specified
   if len(sys.argv) <= 2:
-    if action == 'create':
+    if action in ['create','update']:
       in_path = os.path.join(os.getcwd(),'text')
       out_path = os.path.join(os.getcwd(),'data','stre')
     elif action == 'compsim':
@@ -58,14 +64,18 @@ if __name__ == "__main__":
     store = MemStore()
     print 'Loading the statements from:', in_path
     start = time.time()
-    store.incorporate(in_path)
+    store.incorporate(in_path,procn=util.cpu_count())
     end = time.time()
     print '...finished in %s seconds' % (str(end-start),)
+    print '  ... sources size:', len(store.sources), 'with', \
+      store.sources.lex_size(), 'unique elements'
     print 'Computing the corpus'
     start = time.time()
-    store.computeCorpus()
+    store.computeCorpus(stats=True)
     end = time.time()
     print '...finished in %s seconds' % (str(end-start),)
+    print '  ... corpus size:', len(store.corpus), 'with', \
+      store.corpus.lex_size(), 'unique elements'
     print 'Normalising the corpus'
     start = time.time()
     store.normaliseCorpus()
@@ -76,6 +86,45 @@ if __name__ == "__main__":
     store.exp(out_path)
     end = time.time()
     print '...finished in %s seconds' % (str(end-start),)
+    print 'Saving the store snapshot to:', \
+      os.path.join(out_path,SNAPSHOT_FNAME)
+    start = time.time()
+    store.dump(os.path.join(out_path,SNAPSHOT_FNAME))
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+  elif action == 'update':
+    # adding new statements to an existing store
+    store = MemStore()
+    print 'Loading the store from:', out_path
+    start = time.time()
+    store.imp(out_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+    print 'Adding the statements from:', in_path
+    start = time.time()
+    store.ingest_delta(in_path,procn=util.cpu_count())
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+    print '  ... sources size:', len(store.sources), 'with', \
+      store.sources.lex_size(), 'unique elements'
+    print '  ... corpus size:', len(store.corpus), 'with', \
+      store.corpus.lex_size(), 'unique elements'
+    print 'Normalising the corpus'
+    start = time.time()
+    store.normaliseCorpus()
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+    print 'Exporting the store to:', out_path
+    start = time.time()
+    store.exp(out_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+    print 'Saving the store snapshot to:', \
+      os.path.join(out_path,SNAPSHOT_FNAME)
+    start = time.time()
+    store.dump(os.path.join(out_path,SNAPSHOT_FNAME))
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
   elif action == 'compsim':
     # computing the similarities in an existing store
     # maximum number of similar items
@@ -132,5 +181,11 @@ if __name__ == "__main__":
     store.exp(out_path)
     end = time.time()
     print '...finished in %s seconds' % (str(end-start),)
+    print 'Saving the store snapshot to:', \
+      os.path.join(out_path,SNAPSHOT_FNAME)
+    start = time.time()
+    store.dump(os.path.join(out_path,SNAPSHOT_FNAME))
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
   else:
     print 'Unknown action, try again'
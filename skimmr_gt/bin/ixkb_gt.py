@@ -6,7 +6,9 @@ Guide to execution:
 
 python ixkb_gt.py [FOLDER]
 
-where FOLDER is a path to the knowledge base one wishes to index.
+where FOLDER is a path to the knowledge base one wishes to index. The store
+is loaded from its snapshot if present and up to date (see MemStore.dump()),
+otherwise from the serialisation files.
 
 Copyright (C) 2012 Vit Novacek (vit.novacek@deri.org), Digital Enterprise
 Research Institute (DERI), National University of Ireland Galway (NUIG)
@@ -29,6 +31,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import sys, os, time
 from skimmr_gt import util
 from skimmr_gt.ifce import *
+from skimmr_gt.strg import MemStore, snapshot_path
 
 if __name__ == "__main__":
   # setting the paths to the store and index
@@ -38,9 +41,9 @@ if __name__ == "__main__":
   else:
     # setting the store to the default value
     store_path = os.path.join(os.getcwd(),'data','stre')
-  lexicon_path = os.path.join(store_path,'lexicon.tsv.gz')
-  sources_path = os.path.join(store_path,'sources.tsv.gz')
-  corpus_path = os.path.join(store_path,'corpus.tsv.gz')
+  lexicon_path = lex_path(store_path)
+  sources_path = tensor_path(store_path,'sources')
+  corpus_path = tensor_path(store_path,'corpus')
   index_path = os.path.join(store_path,'index')
   fulltext_path = os.path.join(store_path,'index','fulltext')
   if not os.path.exists(index_path):
@@ -49,13 +52,25 @@ if __name__ == "__main__":
   if not os.path.exists(fulltext_path):
     # create the fulltext index directory if necessary
     os.makedirs(fulltext_path)
+  # loading the whole store from the snapshot if possible
+  store, snap_path = None, snapshot_path(store_path)
+  if snap_path:
+    print '*** Loading the store snapshot from:', snap_path
+    start = time.time()
+    store = MemStore()
+    store.load(snap_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
   # proceeding with creating the indices
   print '*** Creating the fulltext index'
-  print '  ... loading the lexicon from:', lexicon_path
-  start = time.time()
-  lexicon = load_lex(lexicon_path)
-  end = time.time()
-  print '...finished in %s seconds' % (str(end-start),)
+  if store:
+    lexicon = store.lexicon
+  else:
+    print '  ... loading the lexicon from:', lexicon_path
+    start = time.time()
+    lexicon = load_lex(lexicon_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
   print '  ... updating/creating the fulltext index at:', fulltext_path
   # opening/creating the fulltext index
   start = time.time()
@@ -70,25 +85,21 @@ if __name__ == "__main__":
   end = time.time()
   print '...finished in %s seconds' % (str(end-start),)
   print '*** Creating the corpus indices'
-  print '  ... loading the corpus from:', corpus_path
-  start = time.time()
-  corpus = load_corpus(corpus_path)
-  end = time.time()
-  print '...finished in %s seconds' % (str(end-start),)
-  i, suid_lines, term_dict = 0, [], {}
+  if store:
+    corpus = store.corpus
+  else:
+    print '  ... loading the corpus from:', corpus_path
+    start = time.time()
+    corpus = load_corpus(corpus_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
+  i, suid_lines = 0, []
   print '  ... generating the CSV representations from the corpus'
   start = time.time()
   for (s,p,o), w in corpus.items():
     # updating the lines of the SUID CSV
     suid_lines.append('\t'.join([str(x) for x in [i,s,p,o,w]]))
     i += 1
-    # updating the TERM CSV dictionary
-    if not s in term_dict:
-      term_dict[s] = set()
-    if not o in term_dict:
-      term_dict[o] = set()
-    term_dict[s].add((o,w))
-    term_dict[o].add((s,w))
   end = time.time()
   print '...finished in %s seconds' % (str(end-start),)
   print '  ... storing the CSV file:', os.path.join(index_path,'suids.tsv.gz')
@@ -101,21 +112,22 @@ if __name__ == "__main__":
   print '  ... storing the CSV file:', \
     os.path.join(index_path,'termsets.tsv.gz')
   start = time.time()
-  term_lines = []
-  for t1, rel_set in term_dict.items():
-    for t2, w in rel_set:
-      term_lines.append('\t'.join([str(x) for x in [t1,t2,w]]))
+  # streaming the term sets from the corpus fibers
+  term_lines = ['\t'.join([str(x) for x in y]) for y in gen_termsets(corpus)]
   f = gzip.open(os.path.join(index_path,'termsets.tsv.gz'),'wb')
   f.write('\n'.join(term_lines))
   f.close()
   end = time.time()
   print '...finished in %s seconds' % (str(end-start),)
   print '*** Creating the provenance index'
-  print '  ... loading the sources from:', sources_path
-  start = time.time()
-  sources = load_src(sources_path)
-  end = time.time()
-  print '...finished in %s seconds' % (str(end-start),)
+  if store:
+    sources = store.sources
+  else:
+    print '  ... loading the sources from:', sources_path
+    start = time.time()
+    sources = load_src(sources_path)
+    end = time.time()
+    print '...finished in %s seconds' % (str(end-start),)
   print '  ... loading the statement -> SUID mapping from:', \
     os.path.join(index_path,'suids.tsv.gz')
   start = time.time()
@@ -143,7 +155,8 @@ if __name__ == "__main__":
     simrel_id = lexicon[util.SIMR_RELNAME]
   except KeyError:
     sys.stderr.write('\nW@ixkb.py - no similarity relationships present\n')
-  missing, processed = gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id)
+  missing, processed = gen_sim_suid2puid(stmt2suid,suid2puid,f_out,simrel_id,\
+    corpus)
   end = time.time()
   print '...finished in %s seconds' % (str(end-start),)
   print '  - missing sim. provenance info     :', missing
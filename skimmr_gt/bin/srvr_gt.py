@@ -31,7 +31,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import sys, os, BaseHTTPServer, SocketServer, cgi, urlparse, tempfile, re,\
-  hashlib, threading, datetime, shutil, urllib, traceback, time
+  hashlib, threading, datetime, shutil, urllib, traceback, time, json
 # just for testing purposes
 LIB_PATH = '/home/vitnov/Work/devel/eureeka-lite/skimmr_gt/skimmr_gt'
 try:
@@ -486,9 +486,37 @@ class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     f.write(html_temp % (usr_name,usr_name))
     f.close()
 
+  def send_completions(self,pdict):
+    # sending the JSON list of the most frequent lexicon terms completing the
+    # prefix given by the 'prefix' parameter (at most 'k' of them)
+    prefix, k = '', 10
+    if 'prefix' in pdict:
+      prefix = pdict['prefix'][0]
+    if 'k' in pdict:
+      try:
+        k = int(pdict['k'][0])
+      except ValueError:
+        sys.stderr.write('W@send_completions(): invalid size request: '+\
+          pdict['k'][0]+'\n')
+    if INDEX is None:
+      # the index could not be loaded
+      status, body = 503, {'error':'index not loaded'}
+    else:
+      status = 200
+      body = [{'term':x,'freq':y} for x, y in INDEX.complete(prefix,k)]
+    self.send_response(status)
+    self.send_header('Content-type','application/json')
+    self.end_headers()
+    self.wfile.write(json.dumps(body))
+
   def do_GET(self):
    # process static GET requests
 
+   url = urlparse.urlsplit(self.path)
+   if url.path == '/complete':
+     # term completion request, answered in JSON
+     self.send_completions(urlparse.parse_qs(url.query))
+     return
    file_ext = os.path.splitext(self.path)[-1].lower()
    if file_ext == '':
      # empty request, render the login screen
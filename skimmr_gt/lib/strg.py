@@ -24,17 +24,54 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import sys, os, cPickle, gzip, time, re
+import sys, os, gzip, time, re, mmap, struct, tempfile, shutil, json
 import util
-from util import Tensor
+from array import array
+from util import Tensor, CSRMatrix, KeyPacker
 from proc import Analyser
 from math import log
+from itertools import izip
+from multiprocessing import Queue
+from heapq import nlargest, nsmallest, heappush, heappop
+from bisect import bisect_left
 
 # types of all possible perspectives on a ternary corpus
 PERSP_TYPES = ['LAxLIRA','LIxLARA','RAxLALI','LIRAxLA','LARAxLI','LALIxRA',\
 'LAxLIRA_COMPRESSED','LIxLARA_COMPRESSED','RAxLALI_COMPRESSED',\
 'LIRAxLA_COMPRESSED','LARAxLI_COMPRESSED','LALIxRA_COMPRESSED']
 
+# array type code of the lexicon frequencies
+FREQ_TYPECODE = 'l'
+
+# binary lexicon file format - a header (magic string, format version, number
+# of identifiers, number of expressions present and the size of the string 
+# blob), followed by the raw little-endian arrays of the string offsets (one
+# more than identifiers), frequencies (-1 for missing identifiers) and the
+# identifiers sorted by their expressions, and by the blob of the UTF-8 
+# expressions concatenated in the order of the identifiers
+LEXICON_MAGIC = 'SKLX'
+LEXICON_VERSION = 1
+LEXICON_HEADER = struct.Struct('<4sHxxQQQ')
+LEXICON_TYPECODE = 'i'
+# header of the partial statement rows parsed by the parallel workers (number
+# of rows), followed by the raw key element columns and values
+ROWS_HEADER = struct.Struct('<Q')
+# corpus statistics file format - a header (magic string, format version and
+# the number of statements) followed by the statistics tensors in the binary
+# tensor format (see CorpusStatistics)
+STATS_MAGIC = 'SKST'
+STATS_VERSION = 1
+STATS_HEADER = struct.Struct('<4sHxxQ')
+# store snapshot file format - a header (magic string, format version, offset 
+# and size of the manifest), followed by the sections with the lexicon, 
+# tensors, corpus statistics and perspective matrices in their binary formats
+# (each starting at a multiple of 8 bytes), and by the JSON manifest listing
+# the sections (see MemStore.dump())
+SNAPSHOT_MAGIC = 'SKSS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<4sHxxQQ')
+SNAPSHOT_FNAME = 'store.snap'
+
 # pivot dimensions to 'lock' when computing a perspective matricisation
 PERSP2PIVDIM = {
   'LAxLIRA' : 0,
@@ -48,15 +85,20 @@ PERSP2PIVDIM = {
 class Lexicon:
   """
   Two-way dictionary mapping lexical expressions to unique integer identifiers.
+
+  The identifiers are assigned densely from 0, so the expressions and their 
+  frequencies are kept in lists indexed by the identifiers (with None and 0
+  for any identifiers missing in an imported lexicon), and the expressions 
+  are hashed only once, in the mapping to their identifiers.
   """
 
   def __init__(self,items=[]):
-    self.lex2int = {}
-    self.int2lex = {}
-    self.freqdct = {}
+    self.lex2int = {} # expression -> identifier
+    self.int2lex = [] # identifier -> expression
+    self.freqs = array(FREQ_TYPECODE) # identifier -> frequency
     self.current = 0
-    if len(items):
-      self.update(items)
+    self.masks = {} # ignored patterns -> cached exclusion mask (see sorted())
+    self.update(items)
 
   def __len__(self):
     return len(self.lex2int)
@@ -67,7 +109,7 @@ class Lexicon:
 
   def load(self,filename,normalise=True):
     # update the lexicon using a specified filename
-    if normalised:
+    if normalise:
       self.update([self.normalise(x) for x in open(filename,'r')])
     else:
       self.update([x for x in open(filename,'r')])
@@ -75,81 +117,207 @@ class Lexicon:
   def from_file(self,filename):
     # import a lexicon from a tab-separated file (including the index mapping
     # and frequency of the token); expected format: token index frequency
-    lines = []
-    try:
-      # assuming a file object
-      lines = filename.read().split('\n')
-    except AttributeError:
-      # assuming a filename
+    # (the lines are streamed in chunks)
+    f = filename
+    if not hasattr(f,'read'):
       try:
-        lines = open(filename,'r').read().split('\n')
-      except:
-        # if neither file nor filename, proceed with empty lines
-        sys.stderr.write('W (importing a lexicon) - cannot import from: %s\n',\
-          str(filename))
-    for line in lines:
+        f = open(filename,'r')
+      except (IOError,TypeError):
+        sys.stderr.write('W (importing a lexicon) - cannot import from: '+\
+          '%s\n' % (str(filename),))
+        return
+    int2lex, freqs = self.int2lex, self.freqs
+    # the identifiers may be re-assigned, so the cached masks are invalid
+    self.masks = {}
+    fishy, example = 0, None
+    for line in util.iter_lines(f):
+      if not line:
+        continue
       try:
         expr, indx, freq = line.split('\t')[:3]
         indx = int(indx)
         freq = int(freq)
-        self.lex2int[expr] = indx
-        self.int2lex[indx] = expr
-        self.freqdct[expr] = freq
+        if indx == len(int2lex):
+          # the identifiers are exported in ascending order
+          int2lex.append(expr)
+          freqs.append(freq)
+          self.lex2int[expr] = indx
+        elif indx >= 0:
+          self._assign(expr,indx)
+          freqs[indx] = freq
+        else:
+          raise ValueError
       except:
-        sys.stderr.write('W (importing a lexicon) - fishy line:\n%s' % (line,))
-    self.current = max(self.int2lex.keys()) + 1
+        fishy += 1
+        if example is None:
+          example = line
+    if fishy:
+      # one warning for all the fishy lines, rather than one per line
+      sys.stderr.write('W (importing a lexicon) - %d fishy line(s), e.g.:'\
+        '\n%s\n' % (fishy,example))
+    if f != filename:
+      f.close()
+    self.current = len(self.int2lex)
 
   def to_file(self,filename):
+    # exporting a lexicon - inverse to import (streaming the lines in chunks)
     errors = 0
-    # exporting a lexicon - inverse to import
-    try:
-      # assuming a file object
-      #filename.write('\n'.join(['\t'.join([x,str(self.lex2int[x]),\
-      #  str(self.freqdct[x])]) for x in self.lex2int]))
-      for lex in  self.lex2int:
-        try:
-          filename.write('\t'.join([lex,str(self.lex2int[lex]),\
-            str(self.freqdct[lex])])+'\n')
-        except UnicodeEncodeError, UnicodeDecodeError:
-          errors += 1
-      filename.flush()
-      os.fsync(filename.fileno())
-    except AttributeError:
-      # assuming a filename
+    f = filename
+    if not hasattr(f,'write'):
       try:
         f = open(filename,'w')
-        f.write('\n'.join(['\t'.join([x,str(self.lex2int[x]),\
-          str(self.freqdct[x])]) for x in self.lex2int]))
-        f.close()
-      except:
-        # if neither file nor filename, proceed with empty lines
-        sys.stderr.write('W (exporting a lexicon) - cannot export to: %s\n',\
-          str(filename))
+      except (IOError,TypeError):
+        sys.stderr.write('W (exporting a lexicon) - cannot export to: %s\n' % \
+          (str(filename),))
+        return errors
+    lines = []
+    for indx, lex in enumerate(self.int2lex):
+      if lex is None:
+        continue
+      try:
+        lines.append(str('\t'.join([lex,str(indx),str(self.freqs[indx])])))
+      except (UnicodeEncodeError,UnicodeDecodeError):
+        errors += 1
+      if len(lines) >= util.CHUNK_SIZE:
+        f.write('\n'.join(lines)+'\n')
+        lines = []
+    if lines:
+      f.write('\n'.join(lines)+'\n')
+    f.flush()
+    if f != filename:
+      f.close()
+    else:
+      os.fsync(f.fileno())
     return errors
 
+  def to_bin(self,filename):
+    """
+    Exporting a lexicon to a filename or file object in the binary format 
+    (see LEXICON_HEADER), which can be memory-mapped by MappedLexicon.
+    """
+
+    if not hasattr(filename,'write'):
+      # replacing the file, as it may be still mapped (see util.replace_file())
+      return util.replace_file(filename,self.to_bin)
+    f = filename
+    strings = [x.encode('utf-8') if isinstance(x,unicode) else x for x in \
+      self.int2lex]
+    offsets, size = array(LEXICON_TYPECODE,[0]), 0
+    for string in strings:
+      size += len(string or '')
+      offsets.append(size)
+    freqs = array(LEXICON_TYPECODE,[-1 if x is None else y for x, y in \
+      zip(strings,self.freqs)])
+    order = array(LEXICON_TYPECODE,sorted([x for x in range(len(strings)) if \
+      strings[x] is not None],key=strings.__getitem__))
+    f.write(LEXICON_HEADER.pack(LEXICON_MAGIC,LEXICON_VERSION,len(strings),\
+      len(order),size))
+    for seq in (offsets,freqs,order):
+      util.write_array(f,seq,LEXICON_TYPECODE)
+    for i in range(0,len(strings),util.CHUNK_SIZE):
+      f.write(''.join([x or '' for x in strings[i:i+util.CHUNK_SIZE]]))
+    f.flush()
+
+  def freeze(self):
+    """
+    Returns a frozen (read-only) copy of the lexicon, i.e., a MappedLexicon 
+    of its binary export to an anonymous temporary file. The frozen lexicon
+    has no per-entry Python objects, so the processes forked after freezing 
+    (e.g., the util.parex() workers) share one physical copy of it instead 
+    of gradually copying the pages touched by the reference counting. The 
+    expressions are interned lazily, as they are looked up by identifiers.
+    """
+
+    f = tempfile.TemporaryFile()
+    self.to_bin(f)
+    f.seek(0)
+    frozen = MappedLexicon(f,interned=True)
+    # the mapping stays valid after the file is closed and removed
+    f.close()
+    return frozen
+
   def update(self,items):
-    updates = None
+    """
+    Updates the lexicon with the expressions in items (a single expression, 
+    or any iterable, consumed incrementally so that it can be a generator), 
+    assigning new identifiers to the expressions not present yet and 
+    counting the frequencies.
+    """
+
+    updates = items
     if type(items) in [str,unicode]:
       # make sure that single word updates are handled correctly
       updates = [items]
-    else:
-      # expect iterable here
-      updates = list(items)
+    lex2int, int2lex, freqs = self.lex2int, self.int2lex, self.freqs
     for item in updates:
-      # updating the frequency dictionary first
-      if item in self.freqdct:
-        self.freqdct[item] += 1
-      else:
-        self.freqdct[item] = 1
-      if item not in self.lex2int:
-        # udpate the dictionaries if the item is not present
-        self.lex2int[item] = self.current
-        self.int2lex[self.current] = item
+      indx = lex2int.get(item)
+      if indx is None:
+        # assigning a new identifier if the item is not present
+        indx = self.current
+        if indx == len(int2lex):
+          # appending to the lists directly in the common case
+          lex2int[item] = indx
+          int2lex.append(item)
+          freqs.append(0)
+        else:
+          self._assign(item,indx)
         self.current += 1
+      freqs[indx] += 1
+
+  def merge(self,other):
+    """
+    Merges another lexicon into this one - the expressions not present yet 
+    get new identifiers (in the order of their identifiers in the other 
+    lexicon) and the frequencies are added up. Returns an array mapping the 
+    identifiers of the other lexicon to the ones in this lexicon (-1 for the
+    identifiers missing in the other lexicon).
+    """
+
+    remap = array(LEXICON_TYPECODE,[-1])*len(other.int2lex)
+    lex2int, int2lex, freqs = self.lex2int, self.int2lex, self.freqs
+    other_int2lex, other_freqs = other.int2lex, other.freqs
+    for other_indx in other.ids():
+      item = other_int2lex[other_indx]
+      indx = lex2int.get(item)
+      if indx is None:
+        # assigning a new identifier if the item is not present
+        indx = self.current
+        if indx == len(int2lex):
+          lex2int[item] = indx
+          int2lex.append(item)
+          freqs.append(0)
+        else:
+          self._assign(item,indx)
+        self.current += 1
+      freqs[indx] += other_freqs[other_indx]
+      remap[other_indx] = indx
+    return remap
+
+  def _assign(self,expr,indx):
+    # maps the expression and identifier to each other, extending the lists
+    # indexed by the identifiers if necessary
+    if indx >= len(self.int2lex):
+      missing = indx + 1 - len(self.int2lex)
+      self.int2lex.extend([None]*missing)
+      self.freqs.extend([0]*missing)
+    self.lex2int[expr] = indx
+    self.int2lex[indx] = expr
+    if self.masks:
+      self.masks = {}
+
+  def _has_id(self,indx):
+    # checks for the presence of an identifier
+    return 0 <= indx < len(self.int2lex) and self.int2lex[indx] is not None
+
+  def ids(self):
+    # list of all the identifiers present in the lexicon
+    if len(self.lex2int) == len(self.int2lex):
+      return range(len(self.int2lex))
+    return [x for x in range(len(self.int2lex)) if self.int2lex[x] is not None]
 
   def __getitem__(self,key):
     if type(key) in [int,long]:
-      if self.int2lex.has_key(key):
+      if self._has_id(key):
         return self.int2lex[key]
       else:
         raise KeyError('Index %s not present in the lexicon' % (key,))
@@ -164,7 +332,7 @@ class Lexicon:
 
   def has_key(self,key):
     if type(key) in [int,long]:
-      return key in self.int2lex
+      return self._has_id(key)
     elif type(key) in [unicode,str]:
       return key in self.lex2int
     else:
@@ -178,20 +346,19 @@ class Lexicon:
 
   def token_size(self):
     # size in overall number of non-unique tokens
-    return sum(self.freqdct.values())
+    return sum(self.freqs)
 
   def freq(self,token):
     # frequency of a token in the lexicon
     if type(token) in [str,unicode]:
-      if token in self.freqdct:
-        return self.freqdct[token]
+      if token in self.lex2int:
+        return self.freqs[self.lex2int[token]]
       else:
         return 0
     elif type(token) in [int,long]:
-      if self.int2lex[token] in self.freqdct:
-        return self.freqdct[self.int2lex[token]]
-      else:
-        return 0
+      if self._has_id(token):
+        return self.freqs[token]
+      raise KeyError('Index %s not present in the lexicon' % (token,))
     else:
       return 0
 
@@ -203,47 +370,424 @@ class Lexicon:
     #         the average computed while possibly omitting anything that 
     #         matches any of the REs in ignored list
     # > 0 ... impose a limit
-    l = self.freqdct.items()
-    l.sort(key=lambda x: x[1],reverse=reverse)
-    # restricting the list according to a possible limit value
+    # only the whole list is sorted, a fixed limit is selected using a heap
+    # and a dynamic one by sorting only the values above the average (ties
+    # are ordered by the identifiers in all cases)
+    freqs = self.freqs
     if limit > 0:
       # impose a fixed limit
-      l = l[:limit]
+      select = nsmallest
+      if reverse:
+        select = nlargest
+      l = select(limit,self.ids(),key=freqs.__getitem__)
     elif limit == 0:
       # compute a dynamic limit
-      l_cut = []
-      # creating a list without ignored stuff
-      for item in l:
-        ignore = False
-        for regexp in ignored:
-          if re.search(regexp,item[0]):
-            ignore = True
-            break
-        if not ignore:
-          l_cut.append(item)
-      # copmputing average from that list
-      avg = sum([x[1] for x in l_cut])/float(len(l_cut))
+      l = self.ids()
+      if ignored:
+        # creating a list without ignored stuff
+        mask = self._mask(ignored)
+        l = [x for x in l if not mask[x]]
+      if not l:
+        return []
+      # computing average from that list
+      avg = sum([freqs[x] for x in l])/float(len(l))
       # including only the values >= average
-      l = [x for x in l_cut if x[1] >= avg]
+      l = [x for x in l if freqs[x] >= avg]
+      l.sort(key=freqs.__getitem__,reverse=reverse)
     else:
-      # keep the list as is
-      pass
+      l = self.ids()
+      l.sort(key=freqs.__getitem__,reverse=reverse)
     if lexical:
       # returning lexical values
-      return [x[0] for x in l]
+      return [self.int2lex[x] for x in l]
     # returning integer ID values
-    return [self.lex2int[x[0]] for x in l]
+    return l
+
+  def _mask(self,ignored):
+    # exclusion mask of the identifiers whose expressions match any of the 
+    # ignored REs, compiled into a single alternation; the masks are cached 
+    # and only extended to the identifiers added since they were computed
+    key = tuple(ignored)
+    mask = self.masks.get(key)
+    if mask is None:
+      regexp = re.compile('|'.join(['(?:%s)' % (x,) for x in ignored]))
+      mask = self.masks[key] = (regexp,bytearray())
+    regexp, bits = mask
+    int2lex = self.int2lex
+    for indx in xrange(len(bits),len(int2lex)):
+      expr = int2lex[indx]
+      bits.append(expr is not None and regexp.search(expr) is not None)
+    return bits
+
+class MappedLexicon(Lexicon):
+  """
+  Lexicon memory-mapped from the binary format (see Lexicon.to_bin()), 
+  resolving the identifiers and expressions directly in the mapped file 
+  without deserialising anything - the expressions are sliced from the 
+  string blob by their offsets and looked up by binary search in the 
+  identifiers sorted by the expressions. The file is mapped copy-on-write, 
+  so all processes mapping it share one physical copy of the pages.
+
+  The lexicon is read-only as long as it is mapped - any update loads it
+  into memory first (and turns it into a plain Lexicon). If interned is 
+  True, the expressions looked up by identifiers are interned and cached, 
+  so that repeated lookups return the same string objects.
+  """
+
+  def __init__(self,filename,interned=False):
+    f = filename
+    if not hasattr(f,'read'):
+      f = open(filename,'rb')
+    # the lexicon starts at the current file position
+    base = f.tell()
+    magic, version, n, m, size = \
+      LEXICON_HEADER.unpack(f.read(LEXICON_HEADER.size))
+    if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+      raise ValueError('Not a binary lexicon file (or unsupported version)')
+    item_size = array(LEXICON_TYPECODE).itemsize
+    offset = base + LEXICON_HEADER.size
+    blob_offset = offset + (2*n+m+1)*item_size
+    if sys.byteorder == 'little':
+      self.mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_COPY)
+      arrays = []
+      for count in (n+1,n,m):
+        arrays.append(util.map_array(self.mm,offset,LEXICON_TYPECODE,count))
+        offset += count*item_size
+    else:
+      # no mapping if byte swapping is needed
+      arrays = [util.read_array(f,LEXICON_TYPECODE,x) for x in (n+1,n,m)]
+      self.mm = f.read(size)
+      blob_offset = 0
+    offsets, self.freqs, order = arrays
+    self.masks = {}
+    self.int2lex = MappedStrings(self.mm,blob_offset,offsets,self.freqs,\
+      interned)
+    self.lex2int = MappedIndex(self.int2lex,order)
+    self.current = n
+    if f != filename:
+      f.close()
+
+  def _thaw(self):
+    # loading the lexicon into memory, turning it into a plain lexicon
+    int2lex, freqs = list(self.int2lex), array(FREQ_TYPECODE,self.freqs)
+    self.__class__ = Lexicon
+    self.lex2int = dict([(y,x) for x, y in enumerate(int2lex) if y is not \
+      None])
+    self.int2lex = int2lex
+    self.freqs = array(FREQ_TYPECODE,[max(x,0) for x in freqs])
+    del self.mm
+
+  def update(self,items):
+    self._thaw()
+    self.update(items)
+
+  def merge(self,other):
+    self._thaw()
+    return self.merge(other)
+
+  def from_file(self,filename):
+    self._thaw()
+    self.from_file(filename)
+
+  def _has_id(self,indx):
+    # checks for the presence of an identifier (without slicing the blob)
+    return 0 <= indx < len(self.freqs) and self.freqs[indx] >= 0
+
+  def ids(self):
+    # list of all the identifiers present in the lexicon
+    return [x for x in xrange(len(self.freqs)) if self.freqs[x] >= 0]
+
+  def token_size(self):
+    # size in overall number of non-unique tokens (skipping the -1 values of
+    # the missing identifiers)
+    return sum([x for x in self.freqs if x > 0])
+
+class MappedStrings:
+  """
+  Identifier-indexed sequence of the expressions of a memory-mapped lexicon
+  (None for the missing identifiers), possibly interning the expressions.
+  """
+
+  def __init__(self,blob,blob_offset,offsets,freqs,interned=False):
+    self.blob = blob
+    self.blob_offset = blob_offset
+    self.offsets = offsets
+    self.freqs = freqs
+    self.cache = None # identifier -> interned expression
+    if interned:
+      self.cache = {}
+
+  def __len__(self):
+    return len(self.freqs)
+
+  def __getitem__(self,indx):
+    if indx < 0:
+      indx += len(self.freqs)
+    if self.freqs[indx] < 0:
+      return None
+    if self.cache is not None:
+      expr = self.cache.get(indx)
+      if expr is None:
+        expr = self.cache[indx] = intern(self.blob[self.blob_offset+\
+          self.offsets[indx]:self.blob_offset+self.offsets[indx+1]])
+      return expr
+    return self.blob[self.blob_offset+self.offsets[indx]:\
+      self.blob_offset+self.offsets[indx+1]]
+
+  def __iter__(self):
+    for indx in xrange(len(self.freqs)):
+      yield self.__getitem__(indx)
+
+class MappedIndex:
+  """
+  Read-only mapping of the expressions of a memory-mapped lexicon to their
+  identifiers, using binary search in the identifiers sorted by expressions.
+  """
+
+  def __init__(self,strings,order):
+    self.strings = strings
+    self.order = order
+
+  def __len__(self):
+    return len(self.order)
+
+  def get(self,expr,default=None):
+    if isinstance(expr,unicode):
+      expr = expr.encode('utf-8')
+    elif not isinstance(expr,str):
+      return default
+    # slicing the blob directly instead of going through the strings
+    order, offsets = self.order, self.strings.offsets
+    blob, base = self.strings.blob, self.strings.blob_offset
+    lo, hi = 0, len(order)
+    while lo < hi:
+      mid = (lo+hi)//2
+      indx = order[mid]
+      if blob[base+offsets[indx]:base+offsets[indx+1]] < expr:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < len(order):
+      indx = order[lo]
+      if blob[base+offsets[indx]:base+offsets[indx+1]] == expr:
+        return indx
+    return default
+
+  def __getitem__(self,expr):
+    indx = self.get(expr)
+    if indx is None:
+      raise KeyError(expr)
+    return indx
+
+  def has_key(self,expr):
+    return self.get(expr) is not None
+
+  def __contains__(self,expr):
+    return self.has_key(expr)
+
+  def __iter__(self):
+    for indx in self.order:
+      yield self.strings[indx]
+
+  def keys(self):
+    return list(self)
+
+  def values(self):
+    return list(self.order)
+
+  def items(self):
+    return [(self.strings[x],x) for x in self.order]
+
+class PrefixIndex:
+  """
+  Prefix index over the lexicon expressions for term completion, ranked by 
+  the expression frequencies. The expressions (as UTF-8 strings) are kept 
+  in a sorted array, so that all the completions of a prefix form one 
+  range found by binary search, and the most frequent ones are picked from 
+  the range using a segment tree of the frequency maxima - k completions 
+  cost O(k log n) regardless of how many expressions share the prefix.
+
+  For a memory-mapped lexicon, its own array of the identifiers sorted by
+  the expressions is used.
+  """
+
+  def __init__(self,lexicon):
+    self.lexicon = lexicon
+    if isinstance(lexicon,MappedLexicon):
+      # the sorted array is already present in the file
+      self.order = lexicon.lex2int.order
+      self.keys = MappedKeys(lexicon.int2lex,self.order)
+    else:
+      lex2int = lexicon.lex2int
+      exprs = lex2int.keys()
+      if [x for x in exprs if isinstance(x,unicode)]:
+        # sorting the original expressions by their encoded versions
+        pairs = sorted([(x.encode('utf-8') if isinstance(x,unicode) else x,\
+          x) for x in exprs])
+        keys, exprs = [x for x, y in pairs], [y for x, y in pairs]
+      else:
+        exprs.sort()
+        keys = exprs
+      self.keys = keys
+      self.order = array(LEXICON_TYPECODE,[lex2int[x] for x in exprs])
+    # frequencies in the order of the sorted array
+    freqs = lexicon.freqs
+    self.freqs = array(FREQ_TYPECODE,[freqs[x] for x in self.order])
+    # the segment tree - leaves (positions in the sorted array) stored from
+    # the index n on, inner nodes hold the positions of the maxima of their
+    # children (the first one of the equal ones)
+    n = self.n = len(self.order)
+    tree = self.tree = array(LEXICON_TYPECODE,[0]*n) + \
+      array(LEXICON_TYPECODE,xrange(n))
+    freqs = self.freqs
+    for i in xrange(n-1,0,-1):
+      a, b = tree[2*i], tree[2*i+1]
+      if freqs[b] > freqs[a] or (freqs[b] == freqs[a] and b < a):
+        a = b
+      tree[i] = a
+
+  def _range(self,prefix):
+    # range of the positions of the expressions starting with the prefix
+    # ('\xff' never occurs in UTF-8, so it bounds all the continuations)
+    return bisect_left(self.keys,prefix), bisect_left(self.keys,prefix+'\xff')
+
+  def _argmax(self,lo,hi):
+    # position of the maximal frequency in the [lo,hi) range
+    tree, freqs = self.tree, self.freqs
+    best = -1
+    lo, hi = lo + self.n, hi + self.n
+    while lo < hi:
+      if lo & 1:
+        pos = tree[lo]
+        if best < 0 or freqs[pos] > freqs[best] or \
+        (freqs[pos] == freqs[best] and pos < best):
+          best = pos
+        lo += 1
+      if hi & 1:
+        hi -= 1
+        pos = tree[hi]
+        if best < 0 or freqs[pos] > freqs[best] or \
+        (freqs[pos] == freqs[best] and pos < best):
+          best = pos
+      lo, hi = lo >> 1, hi >> 1
+    return best
+
+  def complete(self,prefix,k=10):
+    """
+    Returns a list of at most k (identifier, frequency) tuples of the most 
+    frequent expressions starting with the prefix, sorted by the frequency
+    (ties sorted by the expressions).
+    """
+
+    if isinstance(prefix,unicode):
+      prefix = prefix.encode('utf-8')
+    lo, hi = self._range(prefix)
+    results, heap = [], []
+    if lo < hi:
+      pos = self._argmax(lo,hi)
+      heap.append((-self.freqs[pos],pos,lo,hi))
+    while heap and len(results) < k:
+      # taking the maximum and splitting its range around it
+      freq, pos, lo, hi = heappop(heap)
+      results.append((self.order[pos],-freq))
+      for sub_lo, sub_hi in [(lo,pos),(pos+1,hi)]:
+        if sub_lo < sub_hi:
+          sub_pos = self._argmax(sub_lo,sub_hi)
+          heappush(heap,(-self.freqs[sub_pos],sub_pos,sub_lo,sub_hi))
+    return results
+
+class MappedKeys:
+  """
+  Sorted sequence of the expressions of a memory-mapped lexicon (for the 
+  binary search in PrefixIndex).
+  """
+
+  def __init__(self,strings,order):
+    self.strings = strings
+    self.order = order
+
+  def __len__(self):
+    return len(self.order)
+
+  def __getitem__(self,pos):
+    return self.strings[self.order[pos]]
+
+class CorpusStatistics:
+  """
+  Sufficient statistics of the corpus computed from the sources (see 
+  MemStore.computeCorpus()), allowing for incremental updates of the corpus
+  (see MemStore.ingest_delta()) - the number of statements N, independent 
+  frequencies of the elements (as subjects or objects, in a rank-1 tensor),
+  symmetric joint frequencies of the (x,y), x <= y pairs (rank-2), and the
+  frequencies, relevance sums and raw (not normalised) corpus weights of 
+  the (s,p,o) triples (rank-3 tensors).
+  """
+
+  def __init__(self):
+    self.N = 0
+    self.indep = Tensor(rank=1)
+    self.joint = Tensor(rank=2)
+    self.freqs = Tensor(rank=3)
+    self.rels = Tensor(rank=3)
+    self.weights = Tensor(rank=3)
+
+  def tensors(self):
+    # the statistics tensors in the order of the binary file
+    return [self.indep,self.joint,self.freqs,self.rels,self.weights]
+
+  def to_bin(self,filename):
+    # exporting the statistics to a filename or file object in the binary 
+    # format (a file is replaced, as it may be still mapped, see 
+    # util.replace_file())
+    if not hasattr(filename,'write'):
+      return util.replace_file(filename,self.to_bin)
+    filename.write(STATS_HEADER.pack(STATS_MAGIC,STATS_VERSION,self.N))
+    for tensor in self.tensors():
+      tensor.to_bin(filename)
+
+  def from_bin(self,filename,mapped=True):
+    # importing the statistics from a filename or file object in the binary 
+    # format, starting at the current file position (the tensors are 
+    # memory-mapped by default, see Tensor.from_bin())
+    f = filename
+    if not hasattr(f,'read'):
+      f = open(filename,'rb')
+    magic, version, self.N = STATS_HEADER.unpack(f.read(STATS_HEADER.size))
+    if magic != STATS_MAGIC or version != STATS_VERSION:
+      raise ValueError('Not a corpus statistics file (or unsupported '+\
+        'version)')
+    for tensor in self.tensors():
+      tensor.from_bin(f,mapped=mapped)
+    if f != filename:
+      f.close()
 
 class MemStore:
 
-  def __init__(self,trace=False):
+  def __init__(self,trace=False,packed=False):
     self.lexicon = Lexicon()
     self.sources = Tensor(rank=4)
     self.corpus = Tensor(rank=3)
-    self.perspectives = dict([(x,Tensor(rank=2)) for x in PERSP_TYPES])
+    # sufficient statistics of the corpus (None if not kept)
+    self.stats = None
+    self.perspectives = dict([(x,CSRMatrix()) for x in PERSP_TYPES])
     self.types = {}
     self.synonyms = {}
     self.trace = trace
+    # whether the sources and corpus keys are to be packed into integer words
+    # (with the bit widths implied by the range of the lexicon identifiers)
+    # when building them
+    self.packed = packed
+
+  def packer(self,rank):
+    # key packer of the store tensors of the given rank (or None if the keys
+    # are not to be packed), sized for the whole range of the identifiers 
+    # (including the holes) with some headroom for the new ones - the tensors
+    # are re-packed for a wider range if an identifier does not fit anyway 
+    # (see Tensor.__setitem__())
+    if not self.packed:
+      return None
+    size = len(self.lexicon.int2lex)
+    return KeyPacker(rank,size+(size >> 3)+1)
 
   def convert(self,statement):
     """
@@ -253,56 +797,257 @@ class MemStore:
 
     return tuple([self.lexicon[x] for x in statement])
 
-  def incorporate(self,path,ext='.tsv'):
+  def incorporate(self,path,ext='.tsv',procn=1,changes=None):
     """
     Imports the statements into the store, processing all files with the 
     specified extension ext in the path location. Lexicon and sources 
     structures are updated (not overwritten) in the process. 
+
+    Each file is read only once, parsed into a local lexicon and columns of
+    the local identifiers (see parse_statements()). With procn > 1, the 
+    files are parsed by that many parallel worker processes (util.parex()).
+    The local lexicons are then merged into the store one in the file order,
+    remapping the local identifiers to the global ones, so the result is 
+    the same as with the sequential processing.
+
+    If changes is a dictionary, the previous values of the sources entries
+    being set are recorded in it (see ingest_delta()).
     """
 
-    # first pass to update the lexicon
-    expressions = []
-    for fname in [os.path.join(path,x) for x in os.listdir(path) if 
-    os.path.isfile(os.path.join(path,x)) and \
-    os.path.splitext(x)[-1].lower() == ext.lower()]:
-      for line in open(fname,'r'):
-        try:
-          s,p,o,prov,rel = line.split('\t')[:5]
-          rel = float(rel)
-          expressions += [s,p,o,prov]
-        except:
-          sys.stderr.write('W (loading memory-based store) - '+\
-            'something wrong with line:\n%s' % (line,))
-    self.lexicon.update(expressions)
-    # second pass to update the sources tensor
-    for fname in [os.path.join(path,x) for x in os.listdir(path) if 
-    os.path.isfile(os.path.join(path,x)) and \
-    os.path.splitext(x)[-1].lower() == ext.lower()]:
-      for line in open(fname,'r'):
-        try:
-          s,p,o,prov,rel = line.split('\t')[:5]
-          rel = float(rel)
-          key = tuple([self.lexicon[x] for x in [s,p,o,prov]])
-          self.sources[key] = rel
-        except:
-          sys.stderr.write('W (loading memory-based store) - '+\
-            'something wrong with line:\n%s' % (line,))
+    fnames = [os.path.join(path,x) for x in os.listdir(path) if 
+      os.path.isfile(os.path.join(path,x)) and \
+      os.path.splitext(x)[-1].lower() == ext.lower()]
+    if procn > 1 and len(fnames) > 1:
+      # parsing the files in parallel, the workers store the partial results
+      # in a temporary directory
+      tmp_path = tempfile.mkdtemp()
+      try:
+        prefixes = [os.path.join(tmp_path,str(i)) for i in range(len(fnames))]
+        jobs = Queue()
+        for job in zip(fnames,prefixes):
+          jobs.put(job)
+        util.parex(jobs,processor_ingest,None,(),\
+          procn=min(procn,len(fnames)),store_results=False)
+        # parsing the files left by the workers here (a worker finishes when
+        # the job queue looks empty, which it may for a moment after the jobs
+        # have been put)
+        for job in zip(fnames,prefixes):
+          if not os.path.exists(job[1]+'.rows'):
+            processor_ingest(None,job,None,())
+        lexicons = [MappedLexicon(x+'.lex') for x in prefixes]
+        self._merge_statements(lexicons,(read_rows(x+'.rows') for x in \
+          prefixes),changes)
+      finally:
+        shutil.rmtree(tmp_path)
+    else:
+      partials = [parse_statements(x) for x in fnames]
+      self._merge_statements([x[0] for x in partials],\
+        [x[1:] for x in partials],changes)
+
+  def _merge_statements(self,lexicons,rows,changes=None):
+    # merges the local lexicons and the corresponding (columns,values) rows
+    # of the local identifiers into the lexicon and sources (recording the
+    # previous values in the changes dictionary, if any)
+    remaps = [self.lexicon.merge(x) for x in lexicons]
+    if self.packed:
+      # (re-)packing the sources for the updated lexicon size
+      self.sources.pack(self.packer(4))
+    sources = self.sources
+    for remap, (cols, vals) in izip(remaps,rows):
+      for s, p, o, prov, rel in izip(cols[0],cols[1],cols[2],cols[3],vals):
+        key = (remap[s],remap[p],remap[o],remap[prov])
+        if changes is not None and key not in changes:
+          changes[key] = sources[key]
+        sources[key] = rel
+
+  def ingest_delta(self,path,ext='.tsv',procn=1):
+    """
+    Incorporates the statements in the path location like incorporate(), 
+    updating the corpus incrementally using the sufficient statistics kept 
+    by computeCorpus(stats=True) or imported by imp(). The statistics are 
+    updated by the changed sources entries only, the weights are recomputed
+    only for the affected triples (i.e., the changed ones, and the ones with
+    a subject or object whose frequency changed), while the weights of the 
+    others are just shifted for the changed number of statements N to N' 
+    (as fMI' = fMI + tf*log2(N'/N), the weight grows by rs*log2(N'/N) for 
+    the relevance sum rs). 
+
+    The corpus is then replaced by the updated raw weights (to be normalised
+    by normaliseCorpus(), as after computeCorpus()), any similarity 
+    statements have to be re-computed.
+    """
+
+    if self.stats is None:
+      raise ValueError('No corpus statistics to update, compute the corpus '+\
+        'with computeCorpus(stats=True) first')
+    stats = self.stats
+    changes = {}
+    self.incorporate(path,ext,procn,changes)
+    N = stats.N
+    # updating the statistics by the changed sources entries, collecting the
+    # changed triples and elements
+    triples, elems = set(), set()
+    for key, previous in changes.iteritems():
+      value = self.sources[key]
+      if value == previous:
+        continue
+      s, p, o = key[:3]
+      triple, pair = (s,p,o), (min(s,o),max(s,o))
+      triples.add(triple)
+      delta = 0
+      if previous == 0:
+        delta = 1
+      elif value == 0:
+        delta = -1
+      if delta:
+        N += delta
+        elems.update((s,o))
+        stats.indep[(s,)] += delta
+        stats.indep[(o,)] += delta
+        stats.joint[pair] += delta*(2 if s == o else 1)
+        stats.freqs[triple] += delta
+      if stats.freqs[triple]:
+        stats.rels[triple] += value - previous
+      else:
+        # no rounding errors left for the removed triples
+        stats.rels[triple] = 0.0
+    # the triples affected by the changed independent frequencies
+    stats.freqs.compact()
+    for elem in elems:
+      for dim in (0,2):
+        triples.update([x for x, y in stats.freqs.slice(dim,elem)])
+    # recomputing the weights of the affected triples and shifting the others
+    shift = 0.0
+    if N and stats.N:
+      shift = log(float(N)/stats.N,2)
+    weights = Tensor(rank=3)
+    weights.extend(self._shifted_weights(triples,N,shift))
+    stats.N, stats.weights = N, weights
+    self.corpus = Tensor(rank=3,packer=self.packer(3))
+    self.corpus.extend(weights.iteritems())
+
+  def _shifted_weights(self,triples,N,shift):
+    # generates the ((s,p,o),weight) tuples of the updated raw corpus weights 
+    # (see ingest_delta()) in the order of the triples
+    stats = self.stats
+    rels, weights, joint, indep = stats.rels, stats.weights, stats.joint, \
+      stats.indep
+    for triple, tf in stats.freqs.iteritems():
+      if triple in triples:
+        s, p, o = triple
+        weight = corpus_weight(tf,rels[triple],N,joint[(min(s,o),max(s,o))],\
+          indep[(s,)],indep[(o,)])
+        if weight is None:
+          continue
+      else:
+        weight = weights[triple] + rels[triple]*shift
+      yield triple, weight
 
   def dump(self,filename):
-    # straightforward (but somehow slow) (de)serialisation using cPickle
-    cPickle.dump(self,open(filename,'wb'))
+    """
+    Saves the whole store to a single snapshot file (see SNAPSHOT_HEADER) -
+    the lexicon, sources, corpus, corpus statistics (if kept) and all the 
+    computed perspectives (with their column-wise indices, if computed) are
+    streamed to the file one after another in their binary formats, and 
+    listed in a manifest at the end. The snapshot is written to a temporary
+    file first and then renamed, so that the stores memory-mapping the 
+    previous snapshot (possibly this one) are not affected.
+    """
 
-  def load(self,filename):
-    # straightforward (but somehow slow) (de)serialisation using cPickle
-    self = cPickle(open(filename,'rb'))
+    path = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_fn = tempfile.mkstemp(dir=path)
+    f = os.fdopen(fd,'wb')
+    try:
+      f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,SNAPSHOT_VERSION,0,0))
+      sections = []
+      for section, obj in self._snapshot_sections():
+        f.write('\0'*(-f.tell() % 8))
+        section['offset'] = f.tell()
+        obj.to_bin(f)
+        sections.append(section)
+      manifest = json.dumps({'packed' : self.packed, 'sections' : sections})
+      offset = f.tell()
+      f.write(manifest)
+      # filling in the manifest location
+      f.seek(0)
+      f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,SNAPSHOT_VERSION,offset,\
+        len(manifest)))
+      f.close()
+      os.chmod(tmp_fn,util.file_mode(filename))
+      os.rename(tmp_fn,filename)
+    except:
+      f.close()
+      os.remove(tmp_fn)
+      raise
 
-  def exp(self,path,compress=True,core_only=True):
+  def _snapshot_sections(self):
+    # generates the (manifest entry,object) tuples of the snapshot sections
+    yield {'kind' : 'lexicon'}, self.lexicon
+    yield {'kind' : 'tensor', 'name' : 'sources', 'rank' : 4}, self.sources
+    yield {'kind' : 'tensor', 'name' : 'corpus', 'rank' : 3}, self.corpus
+    if self.stats is not None:
+      yield {'kind' : 'stats'}, self.stats
+    for ptype in PERSP_TYPES:
+      if len(self.perspectives[ptype].rows):
+        yield {'kind' : 'perspective', 'name' : ptype}, \
+          self.perspectives[ptype]
+
+  def load(self,filename,mapped=True):
+    """
+    Loads the whole store from a snapshot file (see dump()), replacing the
+    present contents. By default, the lexicon, tensors and perspective 
+    matrices are memory-mapped directly from the snapshot sections (see 
+    MappedLexicon, Tensor.from_bin() and CSRMatrix.from_bin()), so loading
+    is limited to reading the manifest and the matrix labels.
+    """
+
+    f = open(filename,'rb')
+    magic, version, offset, size = \
+      SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+      raise ValueError('Not a store snapshot file (or unsupported version)')
+    f.seek(offset)
+    manifest = json.loads(f.read(size))
+    self.packed = manifest['packed']
+    self.stats = None
+    self.perspectives = dict([(x,CSRMatrix()) for x in PERSP_TYPES])
+    for section in manifest['sections']:
+      f.seek(section['offset'])
+      kind = section['kind']
+      if kind == 'lexicon':
+        self.lexicon = MappedLexicon(f)
+        if not mapped:
+          self.lexicon._thaw()
+      elif kind == 'tensor' and section['name'] in ['sources','corpus']:
+        tensor = Tensor(rank=section['rank'],\
+          packer=self.packer(section['rank']))
+        tensor.from_bin(f,mapped=mapped)
+        setattr(self,str(section['name']),tensor)
+      elif kind == 'stats':
+        self.stats = CorpusStatistics()
+        self.stats.from_bin(f,mapped=mapped)
+      elif kind == 'perspective' and section['name'] in PERSP_TYPES:
+        matrix = CSRMatrix()
+        matrix.from_bin(f,mapped=mapped)
+        self.perspectives[str(section['name'])] = matrix
+      else:
+        f.close()
+        raise ValueError('Unknown store snapshot section: %s' % \
+          (str(section),))
+    f.close()
+
+  def exp(self,path,compress=True,core_only=True,binary=False):
     # exporting the whole store as tab-separated value files to a directory
     # (gzip compression is used by default)
     # note that only lexicon, sources and corpus structures are exported, any
     # possibly precomputed corpus perspectives have to be re-created!
     # also, integer indices are used - for lexicalised (human readable) export
     # of sources and corpus, use exportSources() and exportCorpus() functions
+    # if binary is True, the sources and corpus are exported in the binary 
+    # tensor format instead (sources.bin and corpus.bin, never compressed),
+    # together with the binary lexicon (lexicon.bin)
+    # the corpus statistics, if kept, are exported to stats.bin (see 
+    # CorpusStatistics and ingest_delta())
     # setting the filenames
     lex_fn = os.path.join(path,'lexicon.tsv')
     src_fn = os.path.join(path,'sources.tsv')
@@ -315,107 +1060,232 @@ class MemStore:
     if compress:
       openner, sig = gzip.open, 'wb'
     lex_f = openner(lex_fn,sig)
-    src_f = openner(src_fn,sig)
-    crp_f = openner(crp_fn,sig)
     self.lexicon.to_file(lex_f)
-    self.sources.to_file(src_f)
-    self.corpus.to_file(crp_f)
     lex_f.close()
-    src_f.close()
-    crp_f.close()
+    if binary:
+      self.lexicon.to_bin(os.path.join(path,'lexicon.bin'))
+      self.sources.to_bin(os.path.join(path,'sources.bin'))
+      self.corpus.to_bin(os.path.join(path,'corpus.bin'))
+    else:
+      src_f = openner(src_fn,sig)
+      crp_f = openner(crp_fn,sig)
+      self.sources.to_file(src_f)
+      self.corpus.to_file(crp_f)
+      src_f.close()
+      crp_f.close()
+    if self.stats is not None:
+      # after the sources, so that the statistics are not older than them
+      self.stats.to_bin(os.path.join(path,'stats.bin'))
 
-  def imp(self,path,compress=True):
+  def imp(self,path,compress=True,mapped=True):
     # importing the whole store as tab-separated value files from a directory
     # effectively an inverse of the exp() function
-    lex_fn = os.path.join(path,'lexicon.tsv')
-    src_fn = os.path.join(path,'sources.tsv')
-    crp_fn = os.path.join(path,'corpus.tsv')
-    if compress:
-      lex_fn += '.gz'
-      src_fn += '.gz'
-      crp_fn += '.gz'
+    # the sources and corpus are imported from the binary tensor files 
+    # instead if they are present (and not older than the tab-separated 
+    # ones), memory-mapping them by default - the same holds for the binary 
+    # lexicon
+    # the corpus statistics are imported if present and not older than the
+    # sources
+    # the whole store is loaded from the snapshot instead if present and not
+    # older than any of the files (see snapshot_path() and load())
+    snap_fn = snapshot_path(path)
+    if snap_fn:
+      self.load(snap_fn,mapped=mapped)
+      return
     openner, sig = open, 'r'
     if compress:
       openner, sig = gzip.open, 'rb'
-    lex_f = openner(lex_fn,sig)
-    src_f = openner(src_fn,sig)
-    crp_f = openner(crp_fn,sig)
-    self.lexicon.from_file(lex_f)
-    self.sources.from_file(src_f)
-    self.corpus.from_file(crp_f)
-    lex_f.close()
-    src_f.close()
-    crp_f.close()
+    lex_fn = store_file(path,'lexicon',compress)
+    if lex_fn.endswith('.bin'):
+      self.lexicon = MappedLexicon(lex_fn)
+      if not mapped:
+        self.lexicon._thaw()
+    else:
+      lex_f = openner(lex_fn,sig)
+      self.lexicon.from_file(lex_f)
+      lex_f.close()
+    for tensor, name in [(self.sources,'sources'),(self.corpus,'corpus')]:
+      fn = store_file(path,name,compress)
+      if fn.endswith('.bin'):
+        tensor.from_bin(fn,mapped=mapped)
+      else:
+        f = openner(fn,sig)
+        tensor.from_file(f)
+        f.close()
+      if tensor is self.sources:
+        src_fn = fn
+    stats_fn = os.path.join(path,'stats.bin')
+    if os.path.exists(stats_fn) and \
+    os.path.getmtime(stats_fn) >= os.path.getmtime(src_fn):
+      self.stats = CorpusStatistics()
+      self.stats.from_bin(stats_fn,mapped=mapped)
+
+  def computeCorpus(self,stats=False):
+    """
+    Computes the corpus tensor from the sources - the weight of each unique 
+    (s,p,o) triple is its frequency times the pointwise mutual information 
+    of s and o (with symmetric joint frequencies), multiplied by the mean 
+    relevance of the triple's provenances.
 
-  def computeCorpus(self):
+    The statistics are computed in grouped passes over the key element 
+    columns of the sources rather than per key - the sources are sorted, so
+    each triple's rows are contiguous, the independent frequencies are the
+    dimension counters maintained by the sources, and the joint frequencies
+    are counted for (s,o) pairs packed into single integers. The write 
+    buffer entries are processed after the columns, in the same order as
+    by iterating the sources, so the relevances are summed up in that order.
+
+    If stats is True, the sufficient statistics are kept in self.stats (see
+    CorpusStatistics) for the incremental updates by ingest_delta().
+    """
+
+    if self.packed:
+      self.corpus.pack(self.packer(3))
+    sources = self.sources
     # number of all triples
-    N = 0 
-    # x -> number of independednt occurences in the store
-    indep_freq = {}
-    # (x,y) -> number of joint occurences in the store
+    N = len(sources)
+    if not N:
+      return
+    # x -> number of independent occurrences in the store (as the subject or
+    # the object)
+    s_counts, o_counts = sources.dim_counts(0), sources.dim_counts(2)
+    # size of the range of the elements, for packing the pairs
+    size = max(max(s_counts),max(o_counts)) + 1
+    # packed (x,y), x <= y -> number of joint occurrences in the store in any
+    # direction (twice the number if x == y, as in both directions)
     joint_freq = {}
-    # (s,p,o) -> number of occurences
-    tripl_freq = {}
-    # (s,p,o) -> (provenance, relevance)
-    spo2pr = {}
-    # going through all the statements in the sources
-    for s,p,o,d in self.sources.keys():
-      N += 1
-      if indep_freq.has_key(s):
-        indep_freq[s] += 1
-      else:
-        indep_freq[s] = 1
-      if indep_freq.has_key(o):
-        indep_freq[o] += 1
-      else:
-        indep_freq[o] = 1
-      if joint_freq.has_key((s,o)):
-        joint_freq[(s,o)] += 1
+    # unique triples in the columns, their numbers of occurrences and sums of
+    # relevances (in the order of the columns)
+    trip_cols = [array(util.KEY_TYPECODE) for i in range(3)]
+    trip_freqs = array(util.KEY_TYPECODE)
+    trip_sums = array(util.VAL_TYPECODE)
+    # going through the column rows, grouping the contiguous triples
+    ps, pp, po, tf, rs = -1, -1, -1, 0, 0.0
+    for s, p, o, rel in izip(sources.dim_col(0),sources.dim_col(1),\
+    sources.dim_col(2),sources.vals):
+      if rel == 0:
+        # skipping the deleted rows
+        continue
+      if s <= o:
+        pair = s*size + o
       else:
-        joint_freq[(s,o)] = 1
-      if tripl_freq.has_key((s,p,o)):
-        tripl_freq[(s,p,o)] += 1
+        pair = o*size + s
+      joint_freq[pair] = joint_freq.get(pair,0) + (2 if s == o else 1)
+      if s == ps and p == pp and o == po:
+        tf += 1
+        rs += rel
+        continue
+      if tf:
+        for col, elem in izip(trip_cols,(ps,pp,po)):
+          col.append(elem)
+        trip_freqs.append(tf)
+        trip_sums.append(rs)
+      ps, pp, po, tf, rs = s, p, o, 1, rel
+    if tf:
+      for col, elem in izip(trip_cols,(ps,pp,po)):
+        col.append(elem)
+      trip_freqs.append(tf)
+      trip_sums.append(rs)
+    # going through the write buffer, (s,p,o) -> relevances in the buffer
+    spo2rels = {}
+    for key, rel in sources.buffer.items():
+      s, p, o = sources._unkey(key)[:3]
+      if s <= o:
+        pair = s*size + o
       else:
-        tripl_freq[(s,p,o)] = 1
-      if not spo2pr.has_key((s,p,o)):
-        spo2pr[(s,p,o)] = []
-      spo2pr[(s,p,o)].append((d,self.sources[(s,p,o,d)]))
+        pair = o*size + s
+      joint_freq[pair] = joint_freq.get(pair,0) + (2 if s == o else 1)
+      spo2rels.setdefault((s,p,o),[]).append(rel)
     # going only through the unique triples now regardless of their provenance
-    for s,p,o in spo2pr:
-      # a list of relevances of particular statement sources
-      src_rels = [x[1] for x in spo2pr[(s,p,o)]]
-      # absolute frequency of the triple times it's mutual information score
-      joint = joint_freq[(s,o)]
-      if (o,s) in joint_freq:
-        joint += joint_freq[(o,s)]
-      # frequency times mutual information score
-      fMI = 0.0
-      try:
-        fMI = \
-        tripl_freq[(s,p,o)]*log(float(N*joint)/(indep_freq[s]*indep_freq[o]),2)
-      except ValueError:
-        continue
-      # setting the corpus tensor value
-      self.corpus[(s,p,o)] = fMI*(float(sum(src_rels))/len(src_rels))
+    # (the triples from the columns come sorted, so the corpus can mostly be
+    # extended in bulk)
+    entries = self._weights(izip(izip(*trip_cols),trip_freqs,trip_sums),\
+      spo2rels,N,joint_freq,size,s_counts,o_counts)
+    if not stats:
+      self.corpus.extend([(x[0],x[3]) for x in entries if x[3] is not None])
+      return
+    # keeping the sufficient statistics for the incremental updates
+    entries = list(entries)
+    self.corpus.extend([(x[0],x[3]) for x in entries if x[3] is not None])
+    self.stats = CorpusStatistics()
+    self.stats.N = N
+    indep = dict(s_counts)
+    for elem, count in o_counts.iteritems():
+      indep[elem] = indep.get(elem,0) + count
+    self.stats.indep.extend([((x,),indep[x]) for x in sorted(indep)])
+    self.stats.joint.extend([((x/size,x%size),y) for x, y in \
+      sorted(joint_freq.iteritems())])
+    self.stats.freqs.extend([(x[0],x[1]) for x in entries])
+    self.stats.rels.extend([(x[0],x[2]) for x in entries])
+    self.stats.weights.extend([(x[0],x[3]) for x in entries if x[3] is not \
+      None])
+
+  def _weights(self,triples,spo2rels,N,joint_freq,size,s_counts,o_counts):
+    # generates the ((s,p,o),tf,rs,weight) tuples, i.e., the frequencies, 
+    # relevance sums and the corpus weights (None if undefined) of the triples
+    # from the statistics computed by computeCorpus() - first for the 
+    # ((s,p,o),tf,rs) triples from the columns (adding the relevances of the 
+    # same triples in the write buffer), then for the ones only in the buffer
+    for triple, tf, rs in triples:
+      buffered = spo2rels.pop(triple,None)
+      if buffered:
+        for rel in buffered:
+          rs += rel
+        tf += len(buffered)
+      yield triple, tf, rs, self._weight(triple,tf,rs,N,joint_freq,size,\
+        s_counts,o_counts)
+    for triple, rels in spo2rels.items():
+      tf, rs = len(rels), sum(rels)
+      yield triple, tf, rs, self._weight(triple,tf,rs,N,joint_freq,size,\
+        s_counts,o_counts)
 
-  def normaliseCorpus(self,cut_off=0.95,min_quo=0.1):
+  def _weight(self,triple,tf,rs,N,joint_freq,size,s_counts,o_counts):
+    # weight of a triple with the given frequency and sum of relevances
+    s, p, o = triple
+    if s <= o:
+      joint = joint_freq[s*size+o]
+    else:
+      joint = joint_freq[o*size+s]
+    indep_s = s_counts.get(s,0) + o_counts.get(s,0)
+    indep_o = s_counts.get(o,0) + o_counts.get(o,0)
+    return corpus_weight(tf,rs,N,joint,indep_s,indep_o)
+
+  def normaliseCorpus(self,cut_off=0.95,min_quo=0.1,sketch=False):
     # corpus normalisation by a value that is greater or equal to the 
     # percentage of weight values given by the cut_off parameter
     # (if the values are below zero, they are set to the min_quo 
-    # fraction of the minimal normalised value
-    ws = sorted(self.corpus.values())
-    norm_cons = ws[int(cut_off*len(ws)):][0]
-    min_norm = min([x for x in ws if x > 0])*min_quo
-    for key in self.corpus:
-      w = self.corpus[key]/norm_cons
+    # fraction of the minimal normalised value; the normalisation value is
+    # selected from the weight array in linear time, or only estimated in 
+    # one pass by a streaming quantile sketch if sketch is True, so that the
+    # weights of a mapped corpus need not be read into memory at once)
+    if sketch:
+      quantile, min_pos = util.P2Quantile(cut_off), float('inf')
+      for w in self.corpus.itervalues():
+        quantile.add(w)
+        if 0 < w < min_pos:
+          min_pos = w
+      if min_pos == float('inf'):
+        raise ValueError('No positive weights in the corpus')
+      norm_cons = quantile.value()
+    else:
+      self.corpus.compact()
+      ws = self.corpus.vals
+      norm_cons = util.select(ws,min(int(cut_off*len(ws)),len(ws)-1))
+      min_pos = min(filter(0.0.__lt__,ws))
+    min_norm = min_pos*min_quo
+    def normalised(w):
+      w = w/norm_cons
       if w < 0:
-        w = min_norm
+        return min_norm
       if w > 1:
-        w = 1.0
-      self.corpus[key] = w
+        return 1.0
+      return w
+    self.corpus.apply(normalised)
 
   def computePerspective(self,ptype):
-    self.perspectives[ptype] = self.corpus.matricise(PERSP2PIVDIM[ptype])
+    # computes a CSR matrix of the corpus perspective (and returns it)
+    self.perspectives[ptype] = self.corpus.matricise_csr(PERSP2PIVDIM[ptype])
+    return self.perspectives[ptype]
 
   def indexSources(self):
     self.sources.index()
@@ -436,14 +1306,14 @@ class MemStore:
       p = self.lexicon[p]
     if type(o) in [unicode,str]:
       o = self.lexicon[o]
-    # evalating query on the sources tensor and collating the results
-    return [x[3] for x, rel in self.sources.query((s,p,o,None))]
+    # going through the sources rows starting with the statement and 
+    # collating the results (no index of the sources is needed)
+    return [x[3] for x, rel in self.sources.prefix((s,p,o))]
     
   def getRelevance(self,prov):
     if type(prov) in [unicode,str]:
       prov = self.lexicon[prov]
-    return max(set([rel for x, rel in \
-      self.sources.query((None,None,None,prov))]))
+    return max(set([rel for x, rel in self.sources.slice(3,prov)]))
 
   def exportSources(self,filename,lexicalised=True):
     # export the sources tensor to a file, in a tab-separated value format,
@@ -469,6 +1339,92 @@ class MemStore:
         (s,p,o),w in self.corpus.items()]))
     f.close()
 
+def store_file(path,name,compress=True):
+  # path to a store file (lexicon, sources or corpus) in the given directory,
+  # preferring the binary version if present and not older than the 
+  # tab-separated value one (which may be re-exported without the binary 
+  # version)
+  fn = os.path.join(path,name+'.tsv')
+  if compress:
+    fn += '.gz'
+  bin_fn = os.path.join(path,name+'.bin')
+  if os.path.exists(bin_fn) and (not os.path.exists(fn) or \
+  os.path.getmtime(bin_fn) >= os.path.getmtime(fn)):
+    return bin_fn
+  return fn
+
+def snapshot_path(path):
+  # path to the store snapshot in the given directory if it is present and 
+  # not older than any of the other store files (None otherwise)
+  snap_fn = os.path.join(path,SNAPSHOT_FNAME)
+  if not os.path.exists(snap_fn):
+    return None
+  mtime = os.path.getmtime(snap_fn)
+  for name in ['lexicon','sources','corpus']:
+    for fn in [name+'.tsv',name+'.tsv.gz',name+'.bin']:
+      fn = os.path.join(path,fn)
+      if os.path.exists(fn) and os.path.getmtime(fn) > mtime:
+        return None
+  return snap_fn
+
+def corpus_weight(tf,rs,N,joint,indep_s,indep_o):
+  # corpus weight of a triple - the frequency tf times the mutual information
+  # score of s and o (with the N statements, joint and independent 
+  # frequencies), times the mean relevance given by the relevance sum rs 
+  # (None if undefined)
+  try:
+    fMI = tf*log(float(N*joint)/(indep_s*indep_o),2)
+  except (ValueError,ZeroDivisionError):
+    return None
+  return fMI*(float(rs)/tf)
+
+def parse_statements(fname):
+  # parses the (s,p,o,prov,rel) statements of a file into a local lexicon,
+  # the columns of the local s, p, o, prov identifiers and the rel values, 
+  # skipping the wrong lines
+  lexicon = Lexicon()
+  lex2int = lexicon.lex2int
+  cols = [array(util.KEY_TYPECODE) for i in range(4)]
+  vals = array(util.VAL_TYPECODE)
+  f = open(fname,'r')
+  for line in f:
+    try:
+      s,p,o,prov,rel = line.split('\t')[:5]
+      rel = float(rel)
+    except:
+      sys.stderr.write('W (loading memory-based store) - '+\
+        'something wrong with line:\n%s' % (line,))
+      continue
+    stmt = (s,p,o,prov)
+    lexicon.update(stmt)
+    for col, expr in izip(cols,stmt):
+      col.append(lex2int[expr])
+    vals.append(rel)
+  f.close()
+  return lexicon, cols, vals
+
+def processor_ingest(identifier,job,lock,args):
+  # parsing a statement file (see parse_statements()), storing the local 
+  # lexicon and rows to files with the given prefix
+  fname, prefix = job
+  lexicon, cols, vals = parse_statements(fname)
+  lexicon.to_bin(prefix+'.lex')
+  f = open(prefix+'.rows','wb')
+  f.write(ROWS_HEADER.pack(len(vals)))
+  for col in cols:
+    util.write_array(f,col,util.KEY_TYPECODE)
+  util.write_array(f,vals,util.VAL_TYPECODE)
+  f.close()
+
+def read_rows(filename):
+  # reading the (columns,values) rows stored by processor_ingest()
+  f = open(filename,'rb')
+  n = ROWS_HEADER.unpack(f.read(ROWS_HEADER.size))[0]
+  cols = [util.read_array(f,util.KEY_TYPECODE,n) for i in range(4)]
+  vals = util.read_array(f,util.VAL_TYPECODE,n)
+  f.close()
+  return cols, vals
+
 if __name__ == "__main__":
   action, in_path, out_path = 'create', os.getcwd(), os.getcwd()
   if len(sys.argv) > 1:
@@ -21,8 +21,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import sys, os, datetime, time, math
+import sys, os, datetime, time, math, mmap, struct, ctypes, threading, random
+import tempfile
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from itertools import izip, repeat, groupby
+from operator import itemgetter
 from multiprocessing import Process, Queue, Lock, cpu_count
+from multiprocessing.sharedctypes import RawArray, RawValue
 from Queue import Empty
 from nltk.stem.porter import PorterStemmer
 from nltk.corpus import wordnet as wn
@@ -42,6 +50,58 @@ SIMR_RELNAME = 'related_to'
 # default source statement file name
 SRCSTM_FNAME = 'srcstm.tsv'
 
+# noun phrase normalisation stuff
+
+# characters stripped from the normalised noun phrases (troublesome re. the 
+# future rendering), and the equivalent unicode translate table
+NP_STRIPPED = '().?!,;{}[]<>/\\+\'"`*'
+NP_UNICODE_TABLE = dict([(ord(x),None) for x in NP_STRIPPED])
+# maximal numbers of the normalised phrases and lemmatised tokens cached
+NP_CACHE_SIZE = 16384
+LEMMA_CACHE_SIZE = 65536
+
+# tensor storage stuff
+
+# array type codes of the tensor key element columns and values (elements not
+# fitting the key type code, such as tuples in matricised tensors, make their
+# column fall back to a plain list)
+KEY_TYPECODE = 'i'
+VAL_TYPECODE = 'd'
+# array type code of the tensor row IDs in the index postings
+ROW_TYPECODE = 'i'
+# array type code and usable bits of the words of packed tensor keys (signed
+# words with the sign bit unused, as they are compared as plain integers)
+WORD_TYPECODE = 'l'
+WORD_BITS = 63
+# minimal size of the tensor write buffer before merging it into the main
+# storage, and the maximal buffer size relative to the main storage (as a bit
+# shift, i.e., 3 means 1/8 of the main storage size)
+BUFFER_MIN = 4096
+BUFFER_SHIFT = 3
+# number of array items processed at once when writing raw array data
+CHUNK_SIZE = 65536
+# ctypes equivalents of the array type codes (for memory-mapped arrays)
+CTYPES = {'i' : ctypes.c_int, 'l' : ctypes.c_long, 'd' : ctypes.c_double}
+# binary tensor file format - a header (magic string, format version, rank
+# and number of entries) followed by the raw little-endian key element 
+# columns (padded to a multiple of 8 bytes) and values
+TENSOR_MAGIC = 'SKTN'
+TENSOR_VERSION = 1
+TENSOR_HEADER = struct.Struct('<4sHHQ')
+# binary CSR matrix format - a header (magic string, format version, ranks of 
+# the row and column labels (0 for single key elements), whether the 
+# column-wise index follows, numbers of rows, columns and entries) followed by
+# the raw little-endian label columns, indptr and indices arrays and values
+# (padded to a multiple of 8 bytes), and possibly by the index matrix
+CSR_MAGIC = 'SKCS'
+CSR_VERSION = 1
+CSR_HEADER = struct.Struct('<4sHBBB7xQQQ')
+# minimal number of tensor entries for the sharded (parallel) execution of the
+# bulk tensor operations to pay off (smaller tensors are processed directly)
+SHARD_MIN = 65536
+# maximal size of a sequence that is sorted when selecting its k-th item
+SELECT_MIN = 1024
+
 def dir_size(start_path='.'):
   # total directory size, recursive
 
@@ -69,21 +129,92 @@ def nominalise(verb):
   # returning None if nothing works
   return None
 
+class LRUCache:
+  """
+  Bounded cache of key-value pairs, discarding the least recently used ones 
+  when the maximal size is exceeded (thread-safe, as it is shared by the 
+  server threads).
+  """
+
+  def __init__(self,size):
+    self.size = size
+    self.items = OrderedDict()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.items)
+
+  def get(self,key,default=None):
+    with self.lock:
+      try:
+        # re-inserting the value to mark it as the most recently used one
+        value = self.items.pop(key)
+      except KeyError:
+        return default
+      self.items[key] = value
+      return value
+
+  def __setitem__(self,key,value):
+    with self.lock:
+      self.items.pop(key,None)
+      self.items[key] = value
+      if len(self.items) > self.size:
+        self.items.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.items.clear()
+
+# caches of the normalised noun phrases (keyed also by the separator and the
+# string type, so that str and unicode phrases get results of their own type) 
+# and the lemmatised tokens, and the optional table of the precomputed 
+# normalised phrases (see precompute_norm_np())
+NP_CACHE = LRUCache(NP_CACHE_SIZE)
+LEMMA_CACHE = LRUCache(LEMMA_CACHE_SIZE)
+NP_TABLE = {}
+
+def lemmatize_noun(token):
+  # lemmatizing a noun token, caching the lemmas
+  key = (type(token),token)
+  lemma = LEMMA_CACHE.get(key)
+  if lemma is None:
+    lemma = LEMMA_CACHE[key] = lmtzr.lemmatize(token,'n')
+  return lemma
+
 def norm_np(term,sep=' '):
   # cleaning up and lemmatizing a noun phrase
   # the separator is dependent on what is used as word separators in the 
   # extracted data (usually it's either a space or an underscore)
-
-  l = [lmtzr.lemmatize(x,'n') for x in term.split()]
-  np = sep.join(l)
-  np = np.lower()
-  # replacing troublesome (re. the future rendering) characters
-  #np = np.replace('-','_')
-  for c in ['(',')','.','?','!',',',';','{','}','[',']','<','>','/','\\','+',\
-  "'",'"','`','*']:
-    np = np.replace(c,'')
+  # the results are looked up in the precomputed table and the cache first
+  key = (type(term),term,sep)
+  np = NP_TABLE.get(key)
+  if np is None:
+    np = NP_CACHE.get(key)
+  if np is None:
+    np = NP_CACHE[key] = _norm_np(term,sep)
   return np
 
+def _norm_np(term,sep=' '):
+  # the actual normalisation, stripping the troublesome (re. the future 
+  # rendering) characters in a single translate pass
+  np = sep.join([lemmatize_noun(x) for x in term.split()]).lower()
+  if isinstance(np,unicode):
+    return np.translate(NP_UNICODE_TABLE)
+  return np.translate(None,NP_STRIPPED)
+
+def precompute_norm_np(terms,sep=' '):
+  """
+  Precomputes the normalised forms of the given noun phrases (e.g., all the
+  lexicon expressions) into a table that is consulted by norm_np() before 
+  anything else, so that querying any of the phrases (for instance, the one
+  picked from the term completions) skips the lemmatisation altogether. 
+  Returns the number of the phrases in the table.
+  """
+
+  for term in terms:
+    NP_TABLE[(type(term),term,sep)] = _norm_np(term,sep)
+  return len(NP_TABLE)
+
 def qiter(q):
   # iterator from a queue object
   while not q.empty():
@@ -317,11 +448,585 @@ store_results=False):
         results.append(result)
   return results
 
+def shard_exec(processor,args,procn=cpu_count()):
+  """
+  Execution of the processor(shard,args) function for the shard numbers 0, 
+  ..., procn-1 in parallel, one forked process per shard. The arguments 
+  (e.g., the input tensors) are thus shared by the processes copy-on-write 
+  instead of being pickled, and the processor is supposed to store its 
+  results in shared memory allocated before the execution (see SharedRows).
+  """
+
+  workers = [Process(target=processor,args=(x,args)) for x in range(procn)]
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  failed = len([x for x in workers if x.exitcode != 0])
+  if failed:
+    raise RuntimeError('%d out of %d shard processes failed' % (failed,procn))
+
+class SharedRows:
+  """
+  Tensor rows (key element columns and values) of a shard in shared memory,
+  i.e., raw ctypes arrays of a fixed capacity, filled by a shard process and
+  read by the parent process once the shard processes are finished.
+  """
+
+  def __init__(self,rank,capacity,values=True,typecode=KEY_TYPECODE):
+    self.typecode = typecode # type code of the key element columns
+    self.cols = [RawArray(CTYPES[typecode],capacity) for x in range(rank)]
+    self.vals = None
+    if values:
+      self.vals = RawArray(CTYPES[VAL_TYPECODE],capacity)
+    self.size = RawValue(ctypes.c_long,0) # number of rows actually written
+
+  def write(self,cols,vals=None):
+    # stores the rows from the given local arrays in the shared memory
+    n = len(cols[0]) if cols else len(vals)
+    for raw, col in zip(self.cols,cols):
+      ctypes.memmove(raw,col.buffer_info()[0],n*col.itemsize)
+    if vals is not None:
+      ctypes.memmove(self.vals,vals.buffer_info()[0],n*vals.itemsize)
+    self.size.value = n
+
+  def read(self):
+    # copies of the written rows as (key element column arrays,value array)
+    n = self.size.value
+    cols = [array(self.typecode,ctypes.string_at(x,n*ctypes.sizeof(x._type_)))\
+      for x in self.cols]
+    vals = None
+    if self.vals is not None:
+      vals = array(VAL_TYPECODE,ctypes.string_at(self.vals,\
+        n*ctypes.sizeof(self.vals._type_)))
+    return cols, vals
+
+def locate(cols,tpl,lo=0,hi=None):
+  """
+  Finds the position of the key tuple tpl in lexicographically sorted key
+  columns (one sequence per dimension), narrowing the [lo,hi) row range by
+  binary search in each column in turn. Returns a (position,found) tuple,
+  where position is the insertion point of the key if it is not present.
+  """
+
+  if hi == None:
+    hi = len(cols[0])
+  last = len(tpl) - 1
+  for col, elem in izip(cols[:last],tpl):
+    lo = bisect_left(col,elem,lo,hi)
+    hi = bisect_right(col,elem,lo,hi)
+    if lo == hi:
+      return lo, False
+  # the last column only needs the insertion point
+  col, elem = cols[last], tpl[last]
+  lo = bisect_left(col,elem,lo,hi)
+  return lo, lo < hi and col[lo] == elem
+
+def gallop(posting,item,lo=0):
+  """
+  Finds the leftmost position of the item in an ascending sequence, starting 
+  from the lo position and probing in exponentially growing steps before the
+  final binary search (cheap when the item is close to lo).
+  """
+
+  n, hi, step = len(posting), lo, 1
+  while hi < n and posting[hi] < item:
+    lo = hi + 1
+    hi += step
+    step *= 2
+  return bisect_left(posting,item,lo,min(hi,n))
+
+def intersect(postings):
+  """
+  Generates the items present in all the given ascending sequences, walking
+  through the first (ideally the shortest) one and galloping through the
+  other ones.
+  """
+
+  first, rest = postings[0], postings[1:]
+  cursors = [0]*len(rest)
+  for item in first:
+    for i, posting in enumerate(rest):
+      cursors[i] = gallop(posting,item,cursors[i])
+      if cursors[i] == len(posting):
+        # one of the sequences exhausted, nothing more to intersect
+        return
+      if posting[cursors[i]] != item:
+        break
+    else:
+      yield item
+
+def select(seq,k):
+  """
+  Returns the k-th smallest item of the sequence (counting from zero) in
+  expected linear time, without sorting it. The bounds bracketing the k-th 
+  item are picked from a sorted random sample and the sequence is narrowed 
+  to the items between them, until it is small enough to be sorted (see 
+  Floyd and Rivest, Expected time bounds for selection, 1975).
+  """
+
+  n = len(seq)
+  if not 0 <= k < n:
+    raise IndexError('Selection index out of range')
+  while n > SELECT_MIN:
+    m = int(n**(2.0/3))
+    sample = sorted(random.sample(seq,m))
+    i, d = k*m//n, int(2*math.sqrt(m))
+    lo, hi = sample[max(i-d,0)], sample[min(i+d,m-1)]
+    below = filter(lo.__gt__,seq)
+    if k < len(below):
+      # the bounds missed the item, narrowing only to the lower part
+      seq = below
+    else:
+      k -= len(below)
+      band = filter(hi.__ge__,filter(lo.__le__,seq))
+      if k < len(band):
+        if lo == hi:
+          # all the band items are equal
+          return lo
+        if len(band) == n:
+          # no progress (many repeated items), sorting directly
+          break
+        seq = band
+      else:
+        # the upper part only
+        k -= len(band)
+        seq = filter(hi.__lt__,seq)
+    n = len(seq)
+  return sorted(seq)[k]
+
+class P2Quantile:
+  """
+  Streaming estimate of the p-quantile of a sequence of values in constant
+  memory, maintaining only five markers whose heights are adjusted by a 
+  piecewise-parabolic interpolation as the values come (see Jain and 
+  Chlamtac, The P2 algorithm for dynamic calculation of quantiles and 
+  histograms without storing observations, 1985).
+  """
+
+  def __init__(self,p):
+    self.p = p
+    self.count = 0
+    # marker heights, their actual and desired positions and the desired
+    # position increments
+    self.heights = []
+    self.positions = [1.0,2.0,3.0,4.0,5.0]
+    self.desired = [1.0,1+2*p,1+4*p,3+2*p,5.0]
+    self.increments = [0.0,p/2,p,(1+p)/2,1.0]
+
+  def add(self,x):
+    # updates the markers with a new value
+    self.count += 1
+    q, n = self.heights, self.positions
+    if len(q) < 5:
+      q.append(x)
+      if len(q) == 5:
+        q.sort()
+      return
+    # locating the cell of the value, extending the extreme markers
+    if x < q[0]:
+      q[0], k = x, 0
+    elif x >= q[4]:
+      q[4], k = x, 3
+    else:
+      k = bisect_right(q,x) - 1
+    for i in range(k+1,5):
+      n[i] += 1
+    for i in range(5):
+      self.desired[i] += self.increments[i]
+    # adjusting the middle markers that are off their desired positions
+    for i in range(1,4):
+      d = self.desired[i] - n[i]
+      if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+        d = 1 if d > 0 else -1
+        h = q[i] + d/(n[i+1]-n[i-1])*((n[i]-n[i-1]+d)*(q[i+1]-q[i])/\
+          (n[i+1]-n[i]) + (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+        if not q[i-1] < h < q[i+1]:
+          # linear interpolation if the parabolic one is out of order
+          h = q[i] + d*(q[i+d]-q[i])/(n[i+d]-n[i])
+        q[i] = h
+        n[i] += d
+
+  def update(self,values):
+    # updates the markers with all the values from a sequence
+    for x in values:
+      self.add(x)
+
+  def value(self):
+    # the current quantile estimate (exact for less than five values)
+    if self.count < 5:
+      return sorted(self.heights)[min(int(self.p*self.count),self.count-1)]
+    return self.heights[2]
+
+def write_array(f,seq,typecode):
+  # writes a sequence to a file object as raw little-endian array data (in 
+  # chunks to avoid copying the whole sequence at once)
+  for i in xrange(0,len(seq),CHUNK_SIZE):
+    chunk = array(typecode,seq[i:i+CHUNK_SIZE])
+    if sys.byteorder != 'little':
+      chunk.byteswap()
+    f.write(chunk.tostring())
+
+def read_array(f,typecode,n):
+  # reads n items of raw little-endian array data from a file object
+  result = array(typecode)
+  result.fromstring(f.read(n*result.itemsize))
+  if sys.byteorder != 'little':
+    result.byteswap()
+  return result
+
+def file_mode(filename):
+  # permissions for (re-)creating a file - those of the file being replaced,
+  # or the default ones given by the umask for a new file (as with open())
+  if os.path.exists(filename):
+    return os.stat(filename).st_mode & 0777
+  umask = os.umask(0)
+  os.umask(umask)
+  return 0666 & ~umask
+
+def replace_file(filename,write):
+  """
+  Writes a binary file by calling write() with a temporary file object in 
+  the same directory, which is then renamed to the filename (keeping the
+  permissions of the replaced file, if any). The previous file is never 
+  truncated, so the processes that memory-map it (possibly the caller) keep
+  their pages valid, and nobody sees a partially written file.
+  """
+
+  fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+  f = os.fdopen(fd,'wb')
+  try:
+    write(f)
+    f.close()
+    os.chmod(tmp_fn,file_mode(filename))
+    os.rename(tmp_fn,filename)
+  except:
+    f.close()
+    os.remove(tmp_fn)
+    raise
+
+def map_array(mm,offset,typecode,n):
+  # a ctypes array of n items backed by a memory map at the given offset
+  return (CTYPES[typecode]*n).from_buffer(mm,offset)
+
+def iter_lines(f,size=CHUNK_SIZE*16):
+  """
+  Generates the lines (without the line breaks) of a file object, reading it
+  in chunks of the given number of bytes so that the memory use does not 
+  depend on the file size. Works with plain as well as gzip file objects.
+  """
+
+  rest = ''
+  while True:
+    chunk = f.read(size)
+    if not chunk:
+      break
+    lines = (rest+chunk).split('\n')
+    rest = lines.pop()
+    for line in lines:
+      yield line
+  if rest:
+    yield rest
+
+def write_lines(f,lines,size=CHUNK_SIZE):
+  # writes the lines to a file object, separated by line breaks, joining 
+  # them in chunks of the given number of lines
+  chunk, sep = [], ''
+  for line in lines:
+    chunk.append(line)
+    if len(chunk) >= size:
+      f.write(sep+'\n'.join(chunk))
+      chunk, sep = [], '\n'
+  if chunk:
+    f.write(sep+'\n'.join(chunk))
+
+def extend_col(cols,col_id,elems):
+  # extends a column of key elements, falling back to a plain list if any of
+  # the elements does not fit the column type code
+  col = cols[col_id]
+  size = len(col)
+  try:
+    col.extend(elems)
+  except (TypeError,OverflowError):
+    # dropping a possibly partial extension and switching to a list
+    del col[size:]
+    cols[col_id] = list(col)
+    cols[col_id].extend(elems)
+
+def merge_rows(sources,agg):
+  """
+  Generates the sorted (key,value) tuples of the k-way merge-join of the 
+  given sorted sources, i.e., (key element columns,values) tuples, keeping 
+  only the non-zero aggregations of the values of each key in all the 
+  sources (in the order of the sources, with zeros for the sources where the
+  key is missing).
+  """
+
+  entries = merge(*[izip(izip(*cols),repeat(i),vals) for i, (cols,vals) in \
+    enumerate(sources)])
+  n = len(sources)
+  for key, group in groupby(entries,itemgetter(0)):
+    group_values = [x[2] for x in group]
+    if len(group_values) < n:
+      group_values.append(0.0)
+    value = agg(group_values)
+    if value:
+      yield key, value
+
+def shard_bounds(tensors,procn):
+  """
+  Splits the sorted rows of the given (compacted) tensors into procn shards
+  at the same keys, picked evenly from the largest tensor, returning the 
+  list of the procn+1 shard boundary row IDs for each tensor.
+  """
+
+  largest = max(tensors,key=lambda x: len(x.vals))
+  n = len(largest.vals)
+  splits = [tuple([x[n*i//procn] for x in largest.cols]) for i in \
+    range(1,procn)]
+  bounds = []
+  for tensor in tensors:
+    size = len(tensor.vals)
+    bounds.append([0]+[locate(tensor.cols,x,0,size)[0] for x in splits]+\
+      [size])
+  return bounds
+
+def shardable(tensors):
+  # checks whether the tensors can be processed in shards - i.e., whether 
+  # there are enough entries, all the key elements are integers and the keys
+  # are stored the same way (packed or not) in all the tensors
+  if sum([len(x.vals) for x in tensors]) < SHARD_MIN:
+    return False
+  if len(set([x.packer for x in tensors])) > 1:
+    return False
+  return not [x for t in tensors for x in t.cols if isinstance(x,list)]
+
+def combine_shard(shard,args):
+  # merge-joins the rows of one shard of the tensors (see combine())
+  tensors, bounds, agg, shared = args
+  sources = []
+  for tensor, rows in zip(tensors,bounds):
+    lo, hi = rows[shard], rows[shard+1]
+    sources.append(([x[lo:hi] for x in tensor.cols],tensor.vals[lo:hi]))
+  cols = tensors[0]._new_cols()
+  vals = array(VAL_TYPECODE)
+  for key, value in merge_rows(sources,agg):
+    for col, key_elem in izip(cols,key):
+      col.append(key_elem)
+    vals.append(value)
+  shared[shard].write(cols,vals)
+
+def map_shard(shard,args):
+  # applies a function to the values of one shard of a tensor rows
+  tensor, bounds, func, shared = args
+  lo, hi = bounds[shard], bounds[shard+1]
+  shared[shard].write([],array(VAL_TYPECODE,map(func,tensor.vals[lo:hi])))
+
+def sum_shard(shard,args):
+  # sums the absolute values of one shard of a tensor rows
+  tensor, bounds, sums = args
+  lo, hi = bounds[shard], bounds[shard+1]
+  sums[shard] = sum([math.fabs(x) for x in tensor.vals[lo:hi]])
+
+def pivot_shard(shard,args):
+  # sorts the row IDs of one shard of the pivot dimension elements by the 
+  # elements (stable sorting keeps the rows with the same pivot element in
+  # the order of the remaining key elements)
+  tensor, pivot_dim, splits, shared = args
+  lo, hi = splits[shard], splits[shard+1]
+  col, vals = tensor.dim_col(pivot_dim), tensor.vals
+  row_ids = [x for x in xrange(len(vals)) if vals[x] != 0 and \
+    (lo is None or col[x] >= lo) and (hi is None or col[x] < hi)]
+  row_ids.sort(key=col.__getitem__)
+  shared[shard].write([array(ROW_TYPECODE,row_ids)])
+
+def combine(tensors,agg=sum,procn=1):
+  """
+  Element-wise combination of any number of tensors of the same rank in a 
+  single k-way merge-join of their sorted entries. Each key present in any 
+  of the tensors gets the aggregation (e.g., sum, max or min) of its values
+  in all of them, in the order of the tensors, with zeros for the tensors 
+  where the key is missing. The non-zero results are appended directly to 
+  the columns of the resulting tensor, which is returned.
+
+  If procn > 1 and the tensors are large enough, the entries are split into
+  procn shards by key ranges, merge-joined in parallel processes and the 
+  shard results are concatenated in order (see shard_exec()).
+  """
+
+  if len(set([x.rank for x in tensors])) != 1:
+    raise NotImplementedError('Cannot combine tensors of different ranks')
+  # the packed keys can be merged directly only if packed the same way
+  packers = set([x.packer for x in tensors])
+  packer = None
+  if len(packers) == 1:
+    packer = packers.pop()
+  result = Tensor(rank=tensors[0].rank,packer=packer)
+  result.counts = None
+  result.procn = max([x.procn for x in tensors]+[procn])
+  for tensor in tensors:
+    tensor.compact()
+  if result.procn > 1 and shardable(tensors):
+    procn = result.procn
+    bounds = shard_bounds(tensors,procn)
+    shared = [SharedRows(len(result.cols),sum([x[i+1]-x[i] for x in bounds]),\
+      typecode=result.typecode) for i in range(procn)]
+    shard_exec(combine_shard,(tensors,bounds,agg,shared),procn)
+    for rows in shared:
+      cols, vals = rows.read()
+      for col_id in range(len(result.cols)):
+        extend_col(result.cols,col_id,cols[col_id])
+      result.vals.extend(vals)
+    return result
+  if packer:
+    sources = [(x.cols,x.vals) for x in tensors]
+  else:
+    sources = [([x.dim_col(y) for y in range(x.rank)],x.vals) for x in tensors]
+  keys, values = [], []
+  for key, value in merge_rows(sources,agg):
+    keys.append(key)
+    values.append(value)
+    if len(keys) >= CHUNK_SIZE:
+      result._append_rows(keys,values)
+      keys, values = [], []
+  result._append_rows(keys,values)
+  return result
+
+class KeyPacker:
+  """
+  Packing of tensor keys (tuples of non-negative integers) into tuples of 
+  fewer integer words. Each key element takes the given number of bits and 
+  as many elements as fit into WORD_BITS share one word, the first ones in 
+  the more significant bits - the packed keys thus sort in the same order as
+  the original tuples. With 21 bits per element (a lexicon of up to 2M 
+  expressions), rank-3 keys pack into a single word and rank-4 ones into a 
+  pair of words.
+  """
+
+  def __init__(self,rank,size):
+    # the bit width is implied by the size of the range of the key elements,
+    # i.e., 0 <= element < size (e.g., the size of the lexicon the elements 
+    # come from)
+    self.rank = rank
+    self.bits = max(1,int(size-1).bit_length())
+    per_word = WORD_BITS // self.bits
+    if not per_word:
+      raise ValueError('Key elements too large to pack: %s' % (str(size),))
+    self.limit = 1 << self.bits
+    self.mask = self.limit - 1
+    # key element positions packed in each word and (word,shift) tuples of 
+    # each key dimension
+    self.spans = [range(i,min(i+per_word,rank)) for i in \
+      range(0,rank,per_word)]
+    self.words = len(self.spans) # number of words per packed key
+    self.layout = []
+    for word_id, span in enumerate(self.spans):
+      for i in span:
+        self.layout.append((word_id,(span[-1]-i)*self.bits))
+
+  def __eq__(self,other):
+    return isinstance(other,KeyPacker) and \
+      (self.rank,self.bits) == (other.rank,other.bits)
+
+  def __ne__(self,other):
+    return not self.__eq__(other)
+
+  def __hash__(self):
+    return hash((self.rank,self.bits))
+
+  def word(self,elems):
+    # packs a sequence of key elements into one word
+    word = 0
+    for elem in elems:
+      if not 0 <= elem < self.limit:
+        raise ValueError('Key element out of the packing range: %s' % \
+          (str(elem),))
+      word = (word << self.bits) | elem
+    return word
+
+  def pack(self,tpl):
+    # packs a key tuple into a tuple of words
+    if min(tpl) < 0 or max(tpl) >= self.limit:
+      raise ValueError('Key element out of the packing range: %s' % \
+        (str(tpl),))
+    bits = self.bits
+    if self.words == 1:
+      word = 0
+      for elem in tpl:
+        word = (word << bits) | elem
+      return (word,)
+    words = []
+    for span in self.spans:
+      word = 0
+      for elem in tpl[span[0]:span[-1]+1]:
+        word = (word << bits) | elem
+      words.append(word)
+    return tuple(words)
+
+  def unpack(self,words):
+    # the key tuple of a tuple of words
+    mask = self.mask
+    return tuple([(words[x] >> y) & mask for x, y in self.layout])
+
+  def pack_cols(self,cols):
+    # packs key element columns into word columns
+    return [array(WORD_TYPECODE,[self.word(x) for x in \
+      izip(*[cols[i] for i in span])]) for span in self.spans]
+
+class PackedColumn:
+  """
+  A read-only key element column of one dimension of a tensor with packed 
+  keys, decoding the elements from the respective word column on the fly.
+  """
+
+  def __init__(self,words,shift,mask):
+    self.words = words
+    self.shift = shift
+    self.mask = mask
+
+  def __len__(self):
+    return len(self.words)
+
+  def __getitem__(self,i):
+    if isinstance(i,slice):
+      return [(x >> self.shift) & self.mask for x in self.words[i]]
+    return (self.words[i] >> self.shift) & self.mask
+
+  def __iter__(self):
+    shift, mask = self.shift, self.mask
+    for word in self.words:
+      yield (word >> shift) & mask
+
 class Tensor:
   """
   A sparse, dictionary-like implementation of square (cube, hyper-cube, etc.) 
   tensors, including basic operations allowing for linear combinations 
   (implemented in parallel).
+
+  The entries are stored in columns - one integer array per dimension and a
+  float array of values, sorted lexicographically by the keys so that they
+  can be looked up by binary search. New keys are collected in a small write
+  buffer that is merged into the sorted columns once it grows too large (or
+  on demand via compact()), deleted entries are kept as zero values in the 
+  columns until then.
+
+  The number of entries per key element in each dimension and the sum of 
+  the values are counted as the tensor is being changed, so that the basic 
+  statistics (see density(), dim_size(), lex_size() and value_sum()) are 
+  available in constant time. The bulk operations that bypass the writes 
+  (loading a binary file, merge-joins) only reset the counters, which are 
+  then recomputed in one pass when the statistics are needed again.
+
+  Setting procn (number of processes) to more than 1 switches on sharded
+  execution of the bulk operations (element-wise aggregations, scalar 
+  multiplication, normalisation and single-dimension matricisation) on large
+  enough tensors - the sorted entries are split into procn shards processed
+  in parallel, with the results exchanged via shared memory (see combine()).
+
+  Optionally, the keys can be packed into integer words (see KeyPacker), in
+  which case the columns hold the words instead of the key elements, the 
+  write buffer is keyed by the packed keys and a lookup takes a single 
+  binary search per word. The keys are only decoded when iterated through.
   """
 
   # @TODO:
@@ -333,106 +1038,436 @@ class Tensor:
   #     and generally enough
   #   * general class for crossover, mutation and iterative evolution of the KB
 
-  def __init__(self,rank):
+  def __init__(self,rank,packer=None):
     self.rank = rank # rank (index field lengt or dimension) of the tensor
-    self.base_dict = {} # core data structure mapping index tuples to values
+    self.packer = packer # packing of the keys into words (None if unpacked)
+    self.typecode = KEY_TYPECODE
+    if packer:
+      self.typecode = WORD_TYPECODE
+    # core data structure - sorted key element (or word) columns and values
+    self.cols = self._new_cols()
+    self.vals = array(VAL_TYPECODE)
+    self.deleted = 0 # number of deleted (zero) rows in the columns
+    self.buffer = {} # write buffer mapping new index tuples to values
     self.midx = {} # auxiliary faster cross-dimensional indices (master)
-    self.ridx = {} # index mapping unique row IDs to particular base_dict keys
+    self.didx = {} # delta index of the write buffer entries (if indexed)
+    self.mapped = False # whether the columns are memory-mapped from a file
+    self.orders = {} # cached row orders along the dimensions (see fibers())
+    # entry counters per dimension and element, entry occurrences per element
+    # in any dimension and the sum of the values (None if to be recomputed)
+    self.counts = [{} for x in range(rank)]
+    self.occurrences = {}
+    self.total = 0.0
+    self.procn = 1 # number of processes for the sharded bulk operations
+
+  def _check_rank(self,tpl):
+    if len(tpl) != self.rank:
+      raise ValueError('Key is rank-incompatible ... key: %s, rank: %s', \
+        (str(tpl),str(self.rank)))
 
-  def __getitem__(self,key):
-    # returns the value indexed by the key
+  def _new_cols(self):
+    # empty key element (or word) columns
+    width = self.rank
+    if self.packer:
+      width = self.packer.words
+    return [array(self.typecode) for x in range(width)]
+
+  def _key(self,key):
+    # the stored form of a key (i.e., packed if the keys are packed)
     tpl = tuple(key)
-    if len(tpl) == self.rank:
-      if tpl in self.base_dict:
-        return self.base_dict[tpl]
-      else:
-        return 0.0 # not present <-> zero value
+    self._check_rank(tpl)
+    if self.packer:
+      return self.packer.pack(tpl)
+    return tpl
+
+  def _unkey(self,skey):
+    # the key tuple of a stored key
+    if self.packer:
+      return self.packer.unpack(skey)
+    return skey
+
+  def dim_col(self,dim):
+    """
+    The key element column of the given dimension - either the column itself,
+    or a read-only view decoding the elements if the keys are packed.
+    """
+
+    if self.packer:
+      word_id, shift = self.packer.layout[dim]
+      return PackedColumn(self.cols[word_id],shift,self.packer.mask)
+    return self.cols[dim]
+
+  def pack(self,packer=None):
+    """
+    Switches to storing the keys packed by the given packer (see KeyPacker),
+    or back to the plain key element columns if the packer is None. The 
+    present entries are converted in one pass.
+    """
+
+    self.compact()
+    cols = [self.dim_col(x) for x in range(self.rank)]
+    self.packer = packer
+    if packer:
+      self.typecode = WORD_TYPECODE
+      self.cols = packer.pack_cols(cols)
     else:
-      raise ValueError('Key is rank-incompatible ... key: %s, rank: %s', \
-        (str(tpl),str(self.rank)))
+      self.typecode = KEY_TYPECODE
+      self.cols = self._new_cols()
+      for col_id in range(self.rank):
+        extend_col(self.cols,col_id,cols[col_id])
+    self.mapped = False
+    self.orders = {}
+
+  def _append_row(self,skey,value,postings=False):
+    # appends a row to the end of the columns (the stored key has to be 
+    # greater than any key in there), possibly adding the new row ID to the 
+    # index postings
+    for col_id in range(len(self.cols)):
+      extend_col(self.cols,col_id,(skey[col_id],))
+    self.vals.append(value)
+    self.orders = {}
+    if postings:
+      rid = len(self.vals) - 1
+      for key_dim, key_elem in enumerate(self._unkey(skey)):
+        try:
+          self.midx[key_dim][key_elem].append(rid)
+        except KeyError:
+          self.midx[key_dim][key_elem] = array(ROW_TYPECODE,(rid,))
+
+  def _append_rows(self,keys,values):
+    # appends a batch of sorted rows to the end of the columns (the stored 
+    # keys have to be greater than any key in there), column by column
+    if not keys:
+      return
+    for col_id, elems in enumerate(izip(*keys)):
+      extend_col(self.cols,col_id,elems)
+    self.vals.extend(values)
+    self.orders = {}
+
+  def extend(self,items):
+    """
+    Sets the values of the (key,value) items. As long as the keys come 
+    sorted and greater than all the keys present, the rows are appended to 
+    the columns in bulk (in chunks), the remaining items are set one by one.
+    """
+
+    bulk = not self.buffer and not self.mapped and not self.midx
+    last = None
+    if self.vals:
+      last = tuple([x[-1] for x in self.cols])
+    keys, values, appended = [], [], False
+    for key, value in items:
+      if bulk:
+        try:
+          skey = self._key(key)
+        except ValueError:
+          # appending the pending rows before the keys are re-packed
+          self._append_rows(keys,values)
+          appended = appended or bool(keys)
+          keys, values = [], []
+          skey = self._widened_key(key)
+          last = None
+          if self.vals:
+            last = tuple([x[-1] for x in self.cols])
+        if last is None or skey > last:
+          if value != 0:
+            keys.append(skey)
+            values.append(value)
+            last = skey
+          if len(keys) >= CHUNK_SIZE:
+            self._append_rows(keys,values)
+            keys, values, appended = [], [], True
+          continue
+        # an out-of-order key, appending the pending rows before setting it
+        self._append_rows(keys,values)
+        appended = appended or bool(keys)
+        keys, values, bulk = [], [], False
+      self.__setitem__(key,value)
+    if keys:
+      self._append_rows(keys,values)
+      appended = True
+    if appended:
+      # the counters are recomputed when needed
+      self.counts = None
+
+  def _update_delta(self,skey,add=True):
+    # adds the stored key of a write buffer entry to the delta index (or 
+    # removes it)
+    for key_dim, key_elem in enumerate(self._unkey(skey)):
+      keys = self.didx[key_dim].setdefault(key_elem,set())
+      if add:
+        keys.add(skey)
+      else:
+        keys.discard(skey)
+        if not keys:
+          del self.didx[key_dim][key_elem]
+
+  def _copy_rows(self,cols,vals,start,end):
+    # appends the non-deleted rows from the start:end range of the given
+    # columns and values to the tensor columns
+    i = start
+    while i < end:
+      if vals[i] == 0:
+        i += 1
+        continue
+      # getting a contiguous range of non-deleted rows to copy in bulk
+      j = i + 1
+      if self.deleted:
+        while j < end and vals[j] != 0:
+          j += 1
+      else:
+        j = end
+      for col_id in range(len(self.cols)):
+        extend_col(self.cols,col_id,cols[col_id][i:j])
+      self.vals.extend(vals[i:j])
+      i = j
+
+  def compact(self):
+    """
+    Merges the write buffer into the sorted columns, dropping the deleted 
+    rows in the process. If the tensor is indexed, the buffer entries are
+    merged into the index postings as well (the delta index is emptied).
+    """
+
+    if not self.buffer and not self.deleted:
+      return
+    pending = sorted(self.buffer.items())
+    cols, vals = self.cols, self.vals
+    self.cols = self._new_cols()
+    self.vals = array(VAL_TYPECODE)
+    start = 0
+    for key, value in pending:
+      end = locate(cols,key,start,len(vals))[0]
+      self._copy_rows(cols,vals,start,end)
+      self._append_row(key,value)
+      start = end
+    self._copy_rows(cols,vals,start,len(vals))
+    self.buffer, self.deleted, self.mapped = {}, 0, False
+    self.orders = {}
+    if self.midx:
+      self._index_columns()
+
+  def __getitem__(self,key):
+    # returns the value indexed by the key
+    try:
+      tpl = self._key(key)
+    except ValueError:
+      if len(tuple(key)) != self.rank:
+        raise
+      return 0.0 # a key that cannot be packed cannot be present
+    if tpl in self.buffer:
+      return self.buffer[tpl]
+    pos, found = locate(self.cols,tpl,0,len(self.vals))
+    if found:
+      return self.vals[pos]
+    return 0.0 # not present <-> zero value
 
   def __delitem__(self,key):
-    # deletes the value indexed by the key (and destroys any indices)
-    tpl = tuple(key)
-    if self.has_key(tpl):
-      del self.base_dict[tpl]
-      self.midx, self.ridx = {}, {}
+    # deletes the value indexed by the key
+    self.__setitem__(key,0.0)
 
   def __setitem__(self,key,value):
-    # sets a new value to the key index
+    # sets a new value to the key index, keeping a possible index up to date
+    # (the changes of present entries do not affect the postings, as the 
+    # deleted rows are skipped when querying, the new ones are either added 
+    # to the postings or to the delta index of the write buffer)
+    try:
+      tpl = self._key(key)
+    except ValueError:
+      tpl = self._widened_key(key)
+    pos, found = locate(self.cols,tpl,0,len(self.vals))
+    self._set(tpl,value,pos,found)
+
+  def _widened_key(self,key):
+    # the stored form of a key with elements out of the packing range, after
+    # re-packing the tensor for (at least) twice the range of the elements, 
+    # or unpacking it if the elements cannot be packed at all (any other 
+    # key error is raised again)
     tpl = tuple(key)
-    if len(tpl) == self.rank:
-      if value != 0:
-        self.base_dict[tpl] = value
-      else:
-        # deleting if setting a value to zero
-        if tpl in self.base_dict:
-          del self.base_dict[tpl]
-      self.midx, self.ridx = {}, {}
+    self._check_rank(tpl)
+    if not self.packer:
+      return self._key(tpl)
+    packer = None
+    if min(tpl) >= 0:
+      try:
+        packer = KeyPacker(self.rank,2*max(max(tpl)+1,self.packer.limit))
+      except ValueError:
+        pass
+    self.pack(packer)
+    return self._key(tpl)
+
+  def _set(self,tpl,value,pos,found):
+    # sets a new value to the stored key already located in the columns (at
+    # the position pos, found or not)
+    if found:
+      previous = self.vals[pos]
     else:
-      raise ValueError('Key is rank-incompatible ... key: %s, rank: %s', \
-        (str(tpl),str(self.rank)))
+      previous = self.buffer.get(tpl,0.0)
+    if self.counts is not None:
+      self.total += value - previous
+      if previous == 0 and value != 0:
+        self._tally(self._unkey(tpl),1)
+      elif previous != 0 and value == 0:
+        self._tally(self._unkey(tpl),-1)
+    if found:
+      # updating the value in place, keeping track of the deleted rows
+      if previous == 0 and value != 0:
+        self.deleted -= 1
+      elif previous != 0 and value == 0:
+        self.deleted += 1
+      self.vals[pos] = value
+    elif value == 0:
+      # deleting if setting a value to zero
+      if tpl in self.buffer:
+        del self.buffer[tpl]
+        if self.midx:
+          self._update_delta(tpl,add=False)
+    elif pos == len(self.vals) and not self.buffer and not self.mapped:
+      # a key greater than all present ones can go directly to the columns
+      self._append_row(tpl,value,postings=bool(self.midx))
+    else:
+      if self.midx and tpl not in self.buffer:
+        self._update_delta(tpl)
+      self.buffer[tpl] = value
+      if len(self.buffer) > max(BUFFER_MIN,len(self.vals) >> BUFFER_SHIFT):
+        self.compact()
 
   def __iter__(self):
     # iterates through the list of all indices
-    for key in self.base_dict:
+    for key, value in self.iteritems():
       yield key
 
   def __contains__(self,key):
     # checks for the presence of key among the basic indices
-    tpl = tuple(key)
-    return tpl in self.base_dict
+    return self.__getitem__(key) != 0
 
   def __len__(self):
     # returns length of the tensor in terms of non-zero indices
-    return len(self.base_dict)
+    return len(self.vals) - self.deleted + len(self.buffer)
+
+  def _tally(self,tpl,delta):
+    # adds delta to the entry counters of the key elements
+    occurrences = self.occurrences
+    for counter, key_elem in izip(self.counts,tpl):
+      count = counter.get(key_elem,0) + delta
+      if count:
+        counter[key_elem] = count
+      else:
+        del counter[key_elem]
+      count = occurrences.get(key_elem,0) + delta
+      if count:
+        occurrences[key_elem] = count
+      else:
+        del occurrences[key_elem]
+
+  def _statistics(self):
+    # the entry counters (and the value sum), recomputed in one pass through
+    # the entries if they were reset by a bulk operation
+    if self.counts is None:
+      counts, occurrences = [{} for x in range(self.rank)], {}
+      for key_dim in range(self.rank):
+        counter = counts[key_dim]
+        for key_elem, value in izip(self.dim_col(key_dim),self.vals):
+          if value != 0:
+            counter[key_elem] = counter.get(key_elem,0) + 1
+        for key in self.buffer:
+          key_elem = self._unkey(key)[key_dim]
+          counter[key_elem] = counter.get(key_elem,0) + 1
+        for key_elem, count in counter.items():
+          occurrences[key_elem] = occurrences.get(key_elem,0) + count
+      self.total = float(sum(self.itervalues()))
+      self.counts, self.occurrences = counts, occurrences
+    return self.counts, self.occurrences
 
   def density(self):
     # density of the tensor in terms of the ratio of number of non-zero 
     # elements w.r.t. the maximum possible number of elements in the current
     # tensor
-    unique_indvals = set()
-    for key in self.base_dict:
-      unique_indvals |= set(key)
-    return float(len(self.base_dict))/(len(unique_indvals)**self.rank)
+    lex_size = self.lex_size()
+    if not lex_size:
+      return 0.0
+    return float(len(self))/(lex_size**self.rank)
 
   def dim_size(self,dim):
     # size of a dimension (i.e., number of unique index IDs in a dimension)
-    # WARNING: can be relatively slow for large/dense tensors
     if dim >= self.rank:
       return 0 
-    return len(set([x[dim] for x in self.base_dict]))
+    return len(self._statistics()[0][dim])
+
+  def dim_counts(self,dim):
+    """
+    Dictionary mapping the elements of a dimension to the numbers of the 
+    (non-zero) entries they occur in (a read-only view of the maintained 
+    counters, which are not to be modified).
+    """
+
+    return self._statistics()[0][dim]
 
   def lex_size(self):
     # return the current lexicon size
-    unique_indvals = set()
-    for key in self.base_dict:
-      unique_indvals |= set(key)
-    return len(unique_indvals)
+    return len(self._statistics()[1])
+
+  def value_sum(self):
+    # sum of all the values of the tensor
+    self._statistics()
+    return self.total
+
+  def iteritems(self):
+    # iterator over all the (key,value) tuples of the tensor (decoding the 
+    # packed keys, if any)
+    if self.packer:
+      unpack = self.packer.unpack
+      for words, value in izip(izip(*self.cols),self.vals):
+        if value != 0:
+          yield unpack(words), value
+      for words, value in self.buffer.items():
+        yield unpack(words), value
+      return
+    for key, value in izip(izip(*self.cols),self.vals):
+      if value != 0:
+        yield key, value
+    for key, value in self.buffer.items():
+      yield key, value
+
+  def iterkeys(self):
+    # iterator over all the keys of the tensor
+    for key, value in self.iteritems():
+      yield key
+
+  def itervalues(self):
+    # iterator over all the values of the tensor
+    for value in self.vals:
+      if value != 0:
+        yield value
+    for value in self.buffer.values():
+      yield value
 
   def items(self):
     # return all the (key,value) tuples of the tensor
-    return self.base_dict.items()
+    return list(self.iteritems())
 
   def keys(self):
     # return all the keys of the tensor
-    return self.base_dict.keys()
+    return list(self.iterkeys())
 
   def values(self):
     # return all the values of the tensor
-    return self.base_dict.values()
+    return list(self.itervalues())
 
   def has_key(self,key):
     # checks for the presence of the key among the tensor indices
-    return key in self.base_dict
+    return self.__contains__(key)
 
   def __eq__(self,other):
     if not isinstance(other,Tensor):
       raise NotImplementedError('Cannot compare tensor with a non-tensor: %s',\
         (str(type(other)),))
-    if self.rank != other.rank:
+    if self.rank != other.rank or len(self) != len(other):
       return False
-    return self.base_dict == other.base_dict
+    for key, value in self.iteritems():
+      if other[key] != value:
+        return False
+    return True
 
   def __ne__(self,other):
     return not self.__eq__(other)
@@ -444,14 +1479,8 @@ class Tensor:
         raise NotImplementedError('Cannot add two tensors of different ranks')
     except AttributeError:
       raise NotImplementedError('Cannot add %s to tensor', (str(type(other)),))
-    result = Tensor(rank=self.rank)
-    # sequential processing
-    for key in set(other.keys() + self.keys()):
-      value = self.__getitem__(key) + other[key]
-      if value:
-        # if the addition is not zero, set it to the resulting tensor
-        result[key] = value
-    return result
+    # merge-join of the sorted entries, keeping only non-zero sums
+    return combine([self,other],sum)
 
   def __mul__(self,other):
     # scalar*tensor multiplication (aT, where a, T are the scalar and tensor
@@ -459,12 +1488,8 @@ class Tensor:
     if type(other) not in [int,float]:
       raise NotImplementedError('Wrong scalar type: %',(str(type(other)),))
     if other == 0:
-      return Tensor(rank=self.rank)
-    result = Tensor(rank=self.rank)
-    # sequential processing
-    for key in self.base_dict:
-      result[key] = other*self.base_dict[key]
-    return result
+      return Tensor(rank=self.rank,packer=self.packer)
+    return self._mapped(lambda x: other*x)
 
   def __rmul__(self,other):
     # scalar*tensor multiplication (swapped operators to allow Ta being 
@@ -480,14 +1505,8 @@ class Tensor:
     except AttributeError:
       raise NotImplementedError('Cannot aggregate %s with a tensor', \
         (str(type(other)),))
-    result = Tensor(rank=self.rank)
-    # sequential processing
-    for key in set(other.keys() + self.keys()):
-      value = max(self.__getitem__(key),other[key])
-      if value:
-        # if the result is not zero, set it to the output tensor
-        result[key] = value
-    return result
+    # merge-join of the sorted entries, keeping only non-zero maxima
+    return combine([self,other],max)
 
   def __and__(self,other):
     # min-based element-wise aggregation of two tensors
@@ -498,104 +1517,357 @@ class Tensor:
     except AttributeError:
       raise NotImplementedError('Cannot aggregate %s with a tensor', \
         (str(type(other)),))
-    result = Tensor(rank=self.rank)
-    # sequential processing
-    for key in set(other.keys() + self.keys()):
-      value = min(self.__getitem__(key),other[key])
-      if value:
-        # if the result is not zero, set it to the output tensor
-        result[key] = value
-    return result
+    # merge-join of the sorted entries, keeping only non-zero minima
+    return combine([self,other],min)
 
   def __iadd__(self,other):
-    return self.__add__(other)
+    # in-place tensor addition, touching only the keys of the other tensor
+    try:
+      if self.rank != other.rank:
+        raise NotImplementedError('Cannot add two tensors of different ranks')
+    except AttributeError:
+      raise NotImplementedError('Cannot add %s to tensor', (str(type(other)),))
+    self._fold(other,lambda x, y: x + y)
+    return self
 
   def __imul__(self,other):
-    return self.__mul__(other)
+    # in-place scalar*tensor multiplication, rewriting the values in the 
+    # existing storage (possible zero results become deleted rows)
+    if type(other) not in [int,float]:
+      raise NotImplementedError('Wrong scalar type: %',(str(type(other)),))
+    if other == 0:
+      indexed = bool(self.midx)
+      self.__init__(rank=self.rank,packer=self.packer)
+      if indexed:
+        self.index()
+      return self
+    vals, deleted = self.vals, 0
+    for i in xrange(len(vals)):
+      if vals[i] == 0:
+        deleted += 1
+        continue
+      vals[i] = other*vals[i]
+      if vals[i] == 0:
+        # an underflow to zero deletes the entry
+        deleted += 1
+        if self.counts is not None:
+          self._tally(self._row_key(i),-1)
+    self.deleted = deleted
+    for key, value in self.buffer.items():
+      self._set(key,other*value,None,False)
+    if self.counts is not None:
+      self.total = float(sum(self.itervalues()))
+    return self
 
   def __iand__(self,other):
-    return self.__and__(other)
+    # in-place min-based element-wise aggregation of two tensors (unlike with
+    # the other in-place operators, all present keys have to be visited, as 
+    # the positive values missing in the other tensor are dropped)
+    try:
+      if self.rank != other.rank:
+        raise NotImplementedError('Cannot aggregate tensors of different'+\
+          ' ranks')
+    except AttributeError:
+      raise NotImplementedError('Cannot aggregate %s with a tensor', \
+        (str(type(other)),))
+    self._fold(other,min)
+    self._clip(other,lambda x: x > 0)
+    return self
 
   def __ior__(self,other):
-    return self.__or__(other)
+    # in-place max-based element-wise aggregation of two tensors (only the
+    # keys of the other tensor are touched, unless there are negative values
+    # missing in the other tensor, which are dropped)
+    try:
+      if self.rank != other.rank:
+        raise NotImplementedError('Cannot aggregate tensors of different'+\
+          ' ranks')
+    except AttributeError:
+      raise NotImplementedError('Cannot aggregate %s with a tensor', \
+        (str(type(other)),))
+    self._fold(other,max)
+    if len(self) and min(self.itervalues()) < 0:
+      self._clip(other,lambda x: x < 0)
+    return self
+
+  def _fold(self,other,agg):
+    # aggregates the entries of the other tensor into this one in place, i.e.,
+    # sets agg(present value,other value) for each key of the other tensor, 
+    # locating each key only once (the other entries are not touched at all)
+    if other is self:
+      other = self._mapped(lambda x: x)
+    for key, value in other.iteritems():
+      try:
+        key = self._key(key)
+      except ValueError:
+        key = self._widened_key(key)
+      pos, found = locate(self.cols,key,0,len(self.vals))
+      if found:
+        current = self.vals[pos]
+      else:
+        current = self.buffer.get(key,0.0)
+      self._set(key,agg(current,value),pos,found)
+
+  def _clip(self,other,cond):
+    # deletes the entries whose values satisfy the condition and whose keys
+    # are missing in the other tensor
+    for key, value in self.items():
+      if cond(value) and not key in other:
+        self.__setitem__(key,0.0)
 
   def normalise(self):
     # abs-sum normalisation of the tensor values
-    result = Tensor(rank=self.rank)
-    n = float(sum([math.fabs(x) for x in self.base_dict.values()]))
-    for key in self.base_dict:
-      result[key] = self.base_dict[key]/n
+    if self.procn > 1 and len(self) >= SHARD_MIN:
+      # summing the shards in parallel
+      self.compact()
+      bounds = shard_bounds([self],self.procn)[0]
+      sums = RawArray(CTYPES[VAL_TYPECODE],self.procn)
+      shard_exec(sum_shard,(self,bounds,sums),self.procn)
+      n = float(sum(sums))
+    else:
+      n = float(sum([math.fabs(x) for x in self.itervalues()]))
+    return self._mapped(lambda x: x/n)
+
+  def apply(self,func):
+    """
+    Applies the function to all values of the tensor in place, in one pass 
+    over the value array by chunks (rewriting also the copy-on-write pages 
+    of a mapped tensor without copying the whole array). The zero results
+    become deleted rows.
+    """
+
+    self.compact()
+    vals, deleted = self.vals, 0
+    for i in xrange(0,len(vals),CHUNK_SIZE):
+      chunk = array(VAL_TYPECODE,map(func,vals[i:i+CHUNK_SIZE]))
+      vals[i:i+len(chunk)] = chunk
+      deleted += chunk.count(0.0)
+    self.deleted = deleted
+    if deleted:
+      self.counts = None
+    elif self.counts is not None:
+      # the same entries, only the value sum changes
+      self.total = float(sum(vals))
+
+  def _mapped(self,func):
+    # a copy of the tensor with the function applied to all values, built 
+    # directly from the sorted columns (possible zero results are kept as
+    # deleted rows until the next compaction), with the values mapped in 
+    # shards in case of the sharded execution
+    self.compact()
+    result = Tensor(rank=self.rank,packer=self.packer)
+    result.procn = self.procn
+    for col_id in range(len(self.cols)):
+      extend_col(result.cols,col_id,self.cols[col_id])
+    if self.procn > 1 and len(self.vals) >= SHARD_MIN:
+      bounds = shard_bounds([self],self.procn)[0]
+      shared = [SharedRows(0,bounds[i+1]-bounds[i]) for i in \
+        range(self.procn)]
+      shard_exec(map_shard,(self,bounds,func,shared),self.procn)
+      for rows in shared:
+        result.vals.extend(rows.read()[1])
+    else:
+      result.vals = array(VAL_TYPECODE,map(func,self.vals))
+    result.deleted = result.vals.count(0.0)
+    if result.deleted or self.counts is None:
+      result.counts = None
+    else:
+      # the same entries, only the value sum changes
+      result.counts = [x.copy() for x in self.counts]
+      result.occurrences = self.occurrences.copy()
+      result.total = float(sum(result.vals))
     return result
 
+  def _row_key(self,rid):
+    # key tuple of a row in the columns
+    return self._unkey(tuple([col[rid] for col in self.cols]))
+
+  def _rows(self,row_ids):
+    # (key,value) tuples of the given non-deleted rows in the columns
+    return [(self._row_key(x),self.vals[x]) for x in row_ids \
+      if self.vals[x] != 0]
+
+  def _index_columns(self):
+    # fills the index postings in a single pass through each column (and 
+    # empties the delta index)
+    midx = {}
+    for key_dim in range(self.rank):
+      postings = {}
+      for rid, key_elem in enumerate(self.dim_col(key_dim)):
+        try:
+          postings[key_elem].append(rid)
+        except KeyError:
+          postings[key_elem] = array(ROW_TYPECODE,(rid,))
+      midx[key_dim] = postings
+    self.midx = midx
+    self.didx = dict([(x,{}) for x in range(self.rank)])
+
   def index(self):
     """
-    @TODO - write up the documentation
+    Builds the cross-dimensional index of the tensor - for each dimension, a
+    dictionary mapping the key elements to posting arrays, i.e., ascending
+    row IDs of the tensor columns that contain the element in that dimension.
+    The write buffer is merged into the columns first so that each entry 
+    has a row ID, and the postings are then filled in a single pass through
+    each column (the time is therefore linear in the number of entries).
+
+    Once built, the index is maintained on writes - new entries that do not
+    go to the end of the columns are kept in a delta index of the write 
+    buffer that the queries consult, and that is merged into the postings 
+    together with the buffer by compact(). 
     """
 
-    # @TODO - do a bit of compl. analysis and profiling here - why so slow?
-
-    # resetting the indices
-    self.ridx, self.midx = {}, {}
-    # contructing the row ID -> key index and dimension ID -> key element ->
-    # set of row IDs indices in one pass through the base dictionary
-    for rid, key in [(x,self.base_dict.keys()[x]) for x in \
-    range(len(self.base_dict))]:
-      # updating the row ID index
-      self.ridx[rid] = key
-      # adding the row ID to the key element value sets
-      for (key_dim,key_elem) in [(x,key[x]) for x in range(len(key))]:
-        if not key_dim in self.midx:
-          self.midx[key_dim] = {}
-        if not key_elem in self.midx[key_dim]:
-          self.midx[key_dim][key_elem] = []
-        self.midx[key_dim][key_elem].append(rid)
-    # changing the filled end lists in the index to sets
-    for key_dim in self.midx:
-      for key_elem in self.midx[key_dim]:
-        self.midx[key_dim][key_elem] = set(self.midx[key_dim][key_elem])
+    self.midx = {}
+    self.compact()
+    self._index_columns()
 
   def query_and(self,query):
     """
-    @TODO - write up the documentation
+    Returns an iterator over the (key,value) tuples of the tensor matching 
+    all the non-None query elements in the respective dimensions (the None 
+    ones are wildcards). Requires the index to be computed first.
+
+    The postings of the bound query elements are processed from the most 
+    selective (i.e., shortest) one, galloping through the other ones, so the
+    cost is driven by the size of the smallest posting, not the tensor.
     """
 
-    if self.midx == {} and self.ridx == {}:
+    if not self.midx:
       raise AttributeError('Tensor index not computed, use index() first')
-    # initialise the matching row IDs set
-    row_ids = set(self.ridx.keys())
-    # proceed through the query, intersecting the row IDs according to it
-    for query_dim, query_elem in [(x,query[x]) for x in range(len(query))]:
-      if query_dim not in self.midx:
-        continue # weird, shouldn't happen, but have it here for sure
+    # getting the postings and delta index sets of the bound query elements
+    postings, deltas = [], []
+    for query_dim, query_elem in enumerate(query):
       if query_elem != None:
-        if query_elem in self.midx[query_dim]:
-          row_ids &= self.midx[query_dim][query_elem]
-        else:
-          # if an index element is not present, result is empty
-          row_ids = set()
-          break
+        postings.append(self.midx[query_dim].get(query_elem,()))
+        deltas.append(self.didx[query_dim].get(query_elem,set()))
+    return self._iter_and(postings,deltas)
+
+  def _iter_and(self,postings,deltas):
+    # generates the query_and() results from the given postings and delta
+    # index sets, starting from the most selective ones
+    if not postings:
+      # no bound element - everything matches
+      row_ids, keys = xrange(len(self.vals)), self.buffer.keys()
+    else:
+      postings.sort(key=len)
+      deltas.sort(key=len)
+      row_ids = intersect(postings)
+      keys = [x for x in deltas[0] if all([x in y for y in deltas[1:]])]
     # generating the (key,value) tuples from the matching row IDs
-    return [(self.ridx[x],self.base_dict[self.ridx[x]]) for x in row_ids]
+    for rid in row_ids:
+      value = self.vals[rid]
+      if value != 0:
+        yield self._row_key(rid), value
+    # ... and from the matching write buffer keys
+    for key in keys:
+      yield self._unkey(key), self.buffer[key]
 
   def query_or(self,query):
     """
-    @TODO - write up the documentation
+    Returns a list of the (key,value) tuples of the tensor matching any of 
+    the non-None query elements in the respective dimensions. Requires the 
+    index to be computed first.
     """
 
-    if self.midx == {} and self.ridx == {}:
+    if not self.midx:
       raise AttributeError('Tensor index not computed, use index() first')
     # initialise the matching row IDs set
     # @TODO - think about the correctness of the semantics in case of 
     #         all-None queries!
-    row_ids = set()
+    row_ids, keys = set(), set()
     # proceed through the query, unioning the row IDs according to it
-    for query_dim, query_elem in [(x,query[x]) for x in range(len(query))]:
-      if query_dim not in self.midx:
-        continue # weird, shouldn't happen, but have it here for sure
-      if query_elem != None and query_elem in self.midx[query_dim]:
-        row_ids |= self.midx[query_dim][query_elem]
+    for query_dim, query_elem in enumerate(query):
+      if query_elem != None:
+        if query_elem in self.midx[query_dim]:
+          row_ids.update(self.midx[query_dim][query_elem])
+        keys.update(self.didx[query_dim].get(query_elem,set()))
     # generating the (key,value) tuples from the matching row IDs
-    return [(self.ridx[x],self.base_dict[self.ridx[x]]) for x in row_ids]
+    return self._rows(sorted(row_ids)) + \
+      [(self._unkey(x),self.buffer[x]) for x in keys]
+
+  def _order(self,dim):
+    # row IDs sorted by the key elements of the dimension and the elements in
+    # that order (the first dimension is sorted already, the other orders are
+    # computed once and cached until the rows change)
+    col = self.dim_col(dim)
+    if dim == 0:
+      return xrange(len(self.vals)), col
+    if dim not in self.orders:
+      # stable sorting keeps the rows with the same element sorted by keys
+      row_ids = array(ROW_TYPECODE,sorted(xrange(len(self.vals)),\
+        key=col.__getitem__))
+      elems = [array(KEY_TYPECODE)]
+      extend_col(elems,0,[col[x] for x in row_ids])
+      self.orders[dim] = (row_ids,elems[0])
+    return self.orders[dim]
+
+  def slice(self,dim,elem):
+    """
+    Returns an iterator over the (key,value) tuples of the tensor with the 
+    given element in the given dimension, sorted by the keys. The entries 
+    are found by binary search in the rows sorted along the dimension, which
+    does not require the index (the first dimension is sorted already, the 
+    other ones are sorted once and the order is cached until the tensor 
+    changes).
+    """
+
+    if dim >= self.rank:
+      raise NotImplementedError('Dimension %s higher than rank %s' % \
+        (str(dim),str(self.rank)))
+    self.compact()
+    row_ids, elems = self._order(dim)
+    lo = bisect_left(elems,elem)
+    hi = bisect_right(elems,elem,lo)
+    if dim == 0:
+      return self._iter_rows(xrange(lo,hi))
+    return self._iter_rows(row_ids[lo:hi])
+
+  def prefix(self,tpl):
+    """
+    Returns an iterator over the (key,value) tuples of the tensor whose keys
+    start with the given tuple of elements, sorted by the keys. The rows are
+    sorted by the keys already, so their range is found by binary search in
+    the leading key element columns (as in locate()), without the index.
+    """
+
+    if len(tpl) > self.rank:
+      raise ValueError('Key prefix longer than rank %s' % (str(self.rank),))
+    self.compact()
+    lo, hi = 0, len(self.vals)
+    for dim, elem in enumerate(tpl):
+      col = self.dim_col(dim)
+      lo = bisect_left(col,elem,lo,hi)
+      hi = bisect_right(col,elem,lo,hi)
+      if lo == hi:
+        break
+    return self._iter_rows(xrange(lo,hi))
+
+  def fibers(self,dim):
+    """
+    Generates the (element,entries) tuples for all the elements present in
+    the given dimension in ascending order, where entries is the list of the
+    (key,value) tuples of the tensor with that element in that dimension, 
+    sorted by the keys. The tensor is thus processed in a single streaming 
+    group-by pass along the dimension, without the index (see slice() for 
+    the details on the rows sorting).
+    """
+
+    if dim >= self.rank:
+      raise NotImplementedError('Dimension %s higher than rank %s' % \
+        (str(dim),str(self.rank)))
+    self.compact()
+    row_ids, elems = self._order(dim)
+    for elem, group in groupby(izip(elems,row_ids),itemgetter(0)):
+      entries = list(self._iter_rows([x[1] for x in group]))
+      if entries:
+        yield elem, entries
+
+  def _iter_rows(self,row_ids):
+    # generates the (key,value) tuples of the given non-deleted rows
+    vals = self.vals
+    for rid in row_ids:
+      if vals[rid] != 0:
+        yield self._row_key(rid), vals[rid]
 
   def query(self,query,qtype='AND'):
     """
@@ -618,12 +1890,13 @@ class Tensor:
     """
     
     m = Tensor(rank=2)
+    m.procn = self.procn
     try:
       # iterable (multiple) pivot dimensions
       if max(pivot_dim) >= self.rank:
         raise NotImplementedError('Max. dimension of %s higher than rank %s',\
           (str(pivot_dim),str(self.rank)))
-      for key, value in self.base_dict.items():
+      for key, value in self.iteritems():
         col_ids, row_ids = [], []
         for i, key_elem in [(x,key[x]) for x in range(len(key))]:
           if i in pivot_dim:
@@ -642,11 +1915,88 @@ class Tensor:
       if pivot_dim >= self.rank:
         raise NotImplementedError('Dimension %s higher than rank %s',\
           (str(pivot_dim),str(self.rank)))
-      for key, value in self.base_dict.items():
+      for key, value in self._pivoted(pivot_dim):
         col_id = tuple(key[:pivot_dim]+key[pivot_dim+1:])
         m[(key[pivot_dim],col_id)] = value
     return m
 
+  def _pivoted(self,pivot_dim):
+    # generates the (key,value) tuples sorted by the pivot dimension element
+    # and then by the remaining key elements (i.e., in the order of the keys
+    # of the matricised tensor), sorting the rows in shards in case of the
+    # sharded execution
+    self.compact()
+    if self.procn > 1 and shardable([self]):
+      # splitting the pivot elements into shards of similar numbers of rows
+      splits, sizes, size, total = [None], [], 0, len(self)
+      for key_elem, count in sorted(self._statistics()[0][pivot_dim].items()):
+        if size >= total*len(splits)//self.procn:
+          splits.append(key_elem)
+          sizes.append(size-sum(sizes))
+        size += count
+      splits.append(None)
+      sizes.append(size-sum(sizes))
+      shared = [SharedRows(1,x,values=False) for x in sizes]
+      shard_exec(pivot_shard,(self,pivot_dim,splits,shared),len(sizes))
+      row_ids = []
+      for rows in shared:
+        row_ids.extend(rows.read()[0][0])
+    else:
+      row_ids = [x for x in xrange(len(self.vals)) if self.vals[x] != 0]
+      row_ids.sort(key=self.dim_col(pivot_dim).__getitem__)
+    for rid in row_ids:
+      yield self._row_key(rid), self.vals[rid]
+
+  def matricise_csr(self,pivot_dim):
+    """
+    Creates a CSR matrix representation of the tensor, using the given 
+    dimension(s) as a pivot. The row and column labels are the same as the 
+    keys of the matricise() result, but interned as integer IDs; the matrix
+    is filled directly from the tensor columns in two linear passes.
+    """
+
+    try:
+      pivots = tuple(pivot_dim)
+      multiple = True
+    except TypeError:
+      pivots = (pivot_dim,)
+      multiple = False
+    if max(pivots) >= self.rank:
+      raise NotImplementedError('Max. dimension of %s higher than rank %s',\
+        (str(pivot_dim),str(self.rank)))
+    self.compact()
+    others = [x for x in range(self.rank) if x not in pivots]
+    # the sequences of the row and column labels of all the tensor entries
+    # (unwrapping the singleton tuples the same way as matricise() does)
+    dim_cols = [self.dim_col(x) for x in range(self.rank)]
+    if multiple and len(pivots) == 1:
+      row_labels = dim_cols[pivots[0]]
+    elif multiple:
+      row_labels = izip(*[dim_cols[x] for x in pivots])
+    else:
+      row_labels = dim_cols[pivot_dim]
+    if multiple and len(others) == 1:
+      col_labels = dim_cols[others[0]]
+    else:
+      col_labels = izip(*[dim_cols[x] for x in others])
+    # interning the labels in the order of their first occurrence
+    row2id, col2id, rows, cols = {}, {}, [], []
+    row_ids, col_ids = array(ROW_TYPECODE), array(ROW_TYPECODE)
+    for row, col in izip(row_labels,col_labels):
+      rid = row2id.get(row)
+      if rid == None:
+        rid = row2id[row] = len(rows)
+        rows.append(row)
+      cid = col2id.get(col)
+      if cid == None:
+        cid = col2id[col] = len(cols)
+        cols.append(col)
+      row_ids.append(rid)
+      col_ids.append(cid)
+    m = CSRMatrix(rows=rows,cols=cols)
+    m.fill(row_ids,col_ids,self.vals)
+    return m
+
   def getSparseDict(self,col2row=True):
     # returns a sparse matrix in a simple dictionary representation that can be
     # directly used for retrieving whole rows (applicable only to matrices); 
@@ -676,64 +2026,335 @@ class Tensor:
     """
 
     return '\n'.join(['\t'.join([str(elem) for elem in key])+' -> '+\
-      str(self.base_dict[key]) for key in self.base_dict])
+      str(value) for key, value in self.iteritems()])
+
+  def iter_tsv(self):
+    """
+    Generates the lines of tab-separated values representing the tensor 
+    (sorted by the keys so that the import can append the rows directly).
+    """
+
+    self.compact()
+    for key, value in self.iteritems():
+      yield '\t'.join([str(elem) for elem in key]+[str(value)])
 
   def tsv(self):
     """
     Generates a string with tab-separated values representing the tensor.
     """
 
-    return '\n'.join(['\t'.join([str(elem) for elem in key]+\
-      [str(self.base_dict[key])]) for key in self.base_dict])
+    return '\n'.join(self.iter_tsv())
 
   def to_file(self,filename):
     """
-    Exporting a lexicon to a filename or file-like object (tab-separated 
-    values).
+    Exporting a tensor to a filename or file-like object (tab-separated 
+    values), streaming the lines in chunks.
     """
 
-    try:
-      # assuming a file object
-      filename.write(self.tsv())
-      filename.flush()
-    except AttributeError:
-      # assuming a filename
+    f = filename
+    if not hasattr(f,'write'):
       try:
         f = open(filename,'w')
-        f.write(self.tsv())
-        f.close()
-      except:
-        # if neither file nor filename, proceed with empty lines
-        sys.stderr.write('W (exporting a tensor) - cannot export to: %s\n',\
-          str(filename))
+      except (IOError,TypeError):
+        sys.stderr.write('W (exporting a tensor) - cannot export to: %s\n' % \
+          (str(filename),))
+        return
+    write_lines(f,self.iter_tsv())
+    f.flush()
+    if f != filename:
+      f.close()
 
   def from_file(self,filename):
     """
     Importing a tensor from a filename or a file-like object (tab-separated
-    values).
+    values), streaming the lines in chunks.
     """
 
-    lines = []
-    try:
-      # assuming a file object
-      lines = filename.read().split('\n')
-    except AttributeError:
-      # assuming a filename
+    f = filename
+    if not hasattr(f,'read'):
       try:
-        lines = open(filename,'r').read().split('\n')
-      except:
-        # if neither file nor filename, proceed with empty lines
-        sys.stderr.write('W (importing a tensor) - cannot import from: %s\n',\
-          str(filename))
-    for line in lines:
+        f = open(filename,'r')
+      except (IOError,TypeError):
+        sys.stderr.write('W (importing a tensor) - cannot import from: '+\
+          '%s\n' % (str(filename),))
+        return
+    for line in iter_lines(f):
+      if not line:
+        continue
       try:
         key_val = line.split('\t')[:self.rank+1]
         key = tuple([int(x) for x in key_val[:-1]])
         val = float(key_val[-1])
-        self.base_dict[key] = val
+        self.__setitem__(key,val)
       except:
         sys.stderr.write('W (importing a tensor) - fishy line:\n%s' % (line,))
+    if f != filename:
+      f.close()
+
+  def to_bin(self,filename):
+    """
+    Exporting a tensor to a filename or file object in the binary format, 
+    i.e., a header with the format version, rank and number of entries, 
+    followed by the raw little-endian key element columns and values. Only 
+    tensors with integer key elements can be exported this way.
+    """
+
+    self.compact()
+    if [x for x in self.cols if isinstance(x,list)]:
+      raise ValueError('Only tensors with integer keys can be exported '+\
+        'to the binary format')
+    if not hasattr(filename,'write'):
+      # replacing the file, as it may be still mapped (see replace_file())
+      return replace_file(filename,self.to_bin)
+    f = filename
+    n = len(self.vals)
+    f.write(TENSOR_HEADER.pack(TENSOR_MAGIC,TENSOR_VERSION,self.rank,n))
+    for key_dim in range(self.rank):
+      write_array(f,self.dim_col(key_dim),KEY_TYPECODE)
+    f.write('\0'*(-self.rank*n*array(KEY_TYPECODE).itemsize % 8))
+    write_array(f,self.vals,VAL_TYPECODE)
+    f.flush()
+
+  def from_bin(self,filename,mapped=True):
+    """
+    Importing a tensor from a filename or file object in the binary format
+    (see to_bin()), starting at the current file position. By default, the
+    file is memory-mapped (copy-on-write) and the tensor columns are used 
+    directly from the mapped pages, without any parsing and with the pages 
+    shared by all processes that map the same file. If the tensor keys are 
+    packed, the columns are packed after loading (and thus not mapped).
+    """
+
+    f = filename
+    if not hasattr(f,'read'):
+      f = open(filename,'rb')
+    base = f.tell()
+    magic, version, rank, n = \
+      TENSOR_HEADER.unpack(f.read(TENSOR_HEADER.size))
+    if magic != TENSOR_MAGIC or version != TENSOR_VERSION:
+      raise ValueError('Not a binary tensor file (or unsupported version)')
+    if rank != self.rank:
+      raise ValueError('Tensor file is rank-incompatible ... rank: %s, '\
+        'expected: %s' % (str(rank),str(self.rank)))
+    key_size = array(KEY_TYPECODE).itemsize
+    offset = base + TENSOR_HEADER.size
+    val_offset = offset + rank*n*key_size
+    val_offset += -(rank*n*key_size) % 8
+    # mapping only real files, and only if no byte swapping is needed
+    try:
+      fileno = f.fileno()
+    except (AttributeError,IOError):
+      mapped = False
+    mapped = mapped and sys.byteorder == 'little'
+    if mapped:
+      mm = mmap.mmap(fileno,0,access=mmap.ACCESS_COPY)
+      self.cols = [map_array(mm,offset+x*n*key_size,KEY_TYPECODE,n) for x \
+        in range(rank)]
+      self.vals = map_array(mm,val_offset,VAL_TYPECODE,n)
+      f.seek(val_offset+n*array(VAL_TYPECODE).itemsize)
+    else:
+      self.cols = [read_array(f,KEY_TYPECODE,n) for x in range(rank)]
+      f.seek(val_offset)
+      self.vals = read_array(f,VAL_TYPECODE,n)
+    self.mapped = mapped
+    self.buffer, self.deleted, self.midx, self.didx = {}, 0, {}, {}
+    self.counts, self.orders = None, {}
+    # the file holds plain key element columns, packing them if required
+    packer, self.packer, self.typecode = self.packer, None, KEY_TYPECODE
+    if packer:
+      self.pack(packer)
+    if f != filename:
+      f.close()
+
+class CSRMatrix:
+  """
+  A sparse matrix in the compressed sparse row (CSR) format - the column IDs
+  and values of all the rows are concatenated in the indices and data arrays,
+  with the boundaries of the particular rows kept in the indptr array. The 
+  row and column labels (tensor key elements or tuples of them) are interned
+  as integer IDs given by their positions in the rows and cols lists.
+  """
+
+  def __init__(self,rows=[],cols=[]):
+    self.rows = list(rows) # row labels
+    self.cols = list(cols) # column labels
+    self.row_ids = dict([(x,i) for i, x in enumerate(self.rows)])
+    self.indptr = array(ROW_TYPECODE,[0])*(len(self.rows)+1)
+    self.indices = array(ROW_TYPECODE) # column IDs of the entries
+    self.data = array(VAL_TYPECODE) # values of the entries
+    self.csc = None # column-wise index (the transposed matrix)
+
+  def fill(self,row_ids,col_ids,values):
+    """
+    Fills the matrix from parallel sequences of row IDs, column IDs and 
+    values, grouping them by the rows using a counting sort (the order of the
+    entries within each row is kept).
+    """
+
+    nrows = len(self.rows)
+    indptr = array(ROW_TYPECODE,[0])*(nrows+1)
+    for rid in row_ids:
+      indptr[rid+1] += 1
+    for rid in xrange(nrows):
+      indptr[rid+1] += indptr[rid]
+    # the next free positions of the particular rows
+    free = array(ROW_TYPECODE,indptr)
+    self.indices = array(ROW_TYPECODE,[0])*indptr[-1]
+    self.data = array(VAL_TYPECODE,[0.0])*indptr[-1]
+    for rid, cid, value in izip(row_ids,col_ids,values):
+      pos = free[rid]
+      self.indices[pos] = cid
+      self.data[pos] = value
+      free[rid] = pos + 1
+    self.indptr = indptr
+    self.csc = None
+
+  def __len__(self):
+    # number of non-zero entries
+    return len(self.data)
+
+  def __contains__(self,row):
+    return row in self.row_ids
+
+  def __iter__(self):
+    # iterates through the row labels
+    return iter(self.rows)
+
+  def __getitem__(self,row):
+    # the row with the given label as a column label -> value dictionary
+    cids, values = self.getrow(self.row_ids[row])
+    return dict([(self.cols[x],y) for x, y in izip(cids,values)])
+
+  def getrow(self,rid):
+    # (column IDs,values) arrays of the row with the given ID
+    start, end = self.indptr[rid], self.indptr[rid+1]
+    return self.indices[start:end], self.data[start:end]
+
+  def transpose(self):
+    # the transposed matrix (rows are ordered by the original column IDs)
+    row_ids = array(ROW_TYPECODE)
+    for rid in xrange(len(self.rows)):
+      row_ids.extend(array(ROW_TYPECODE,[rid])*\
+        (self.indptr[rid+1]-self.indptr[rid]))
+    result = CSRMatrix(rows=self.cols,cols=self.rows)
+    result.fill(self.indices,row_ids,self.data)
+    return result
+
+  def index(self):
+    # computes the column-wise index, i.e., the transposed matrix giving the 
+    # IDs of the rows with non-zero elements in particular columns
+    self.csc = self.transpose()
+
+  def to_bin(self,filename):
+    """
+    Exporting a matrix to a filename or file object in the binary format 
+    (see CSR_HEADER), including the column-wise index if computed. Only
+    matrices labelled by integer key elements (or tuples of them) can be 
+    exported this way.
+    """
+
+    f = filename
+    if not hasattr(f,'write'):
+      f = open(filename,'wb')
+    label_ranks = [len(x[0]) if x and isinstance(x[0],tuple) else 0 for x in \
+      (self.rows,self.cols)]
+    nnz = len(self.data)
+    f.write(CSR_HEADER.pack(CSR_MAGIC,CSR_VERSION,label_ranks[0],\
+      label_ranks[1],self.csc is not None,len(self.rows),len(self.cols),nnz))
+    for labels, rank in zip((self.rows,self.cols),label_ranks):
+      if not rank:
+        write_array(f,labels,KEY_TYPECODE)
+      for key_dim in range(rank):
+        write_array(f,[x[key_dim] for x in labels],KEY_TYPECODE)
+    write_array(f,self.indptr,ROW_TYPECODE)
+    write_array(f,self.indices,ROW_TYPECODE)
+    f.write('\0'*(-self._data_offset(label_ranks,len(self.rows),\
+      len(self.cols),nnz) % 8))
+    write_array(f,self.data,VAL_TYPECODE)
+    if self.csc is not None:
+      self.csc.to_bin(f)
+    f.flush()
+    if f != filename:
+      f.close()
+
+  def _data_offset(self,label_ranks,nrows,ncols,nnz):
+    # size of the binary matrix header, label columns and index arrays (see
+    # to_bin()), i.e., the unpadded offset of the values
+    key_size = array(KEY_TYPECODE).itemsize
+    row_size = array(ROW_TYPECODE).itemsize
+    return CSR_HEADER.size + key_size*(max(label_ranks[0],1)*nrows + \
+      max(label_ranks[1],1)*ncols) + row_size*(nrows+1+nnz)
+
+  def from_bin(self,filename,mapped=True):
+    """
+    Importing a matrix from a filename or file object in the binary format
+    (see to_bin()), starting at the current file position. By default, the
+    indptr, indices and data arrays are memory-mapped (copy-on-write) like 
+    the binary tensor columns, only the row and column labels are loaded.
+    """
+
+    f = filename
+    if not hasattr(f,'read'):
+      f = open(filename,'rb')
+    base = f.tell()
+    magic, version, row_rank, col_rank, indexed, nrows, ncols, nnz = \
+      CSR_HEADER.unpack(f.read(CSR_HEADER.size))
+    if magic != CSR_MAGIC or version != CSR_VERSION:
+      raise ValueError('Not a binary CSR matrix file (or unsupported '+\
+        'version)')
+    label_ranks = (row_rank,col_rank)
+    val_offset = self._data_offset(label_ranks,nrows,ncols,nnz)
+    val_offset = base + val_offset + (-val_offset % 8)
+    # the label columns are always read, the rest is mapped from real files 
+    # only, and only if no byte swapping is needed
+    labels = []
+    for rank, n in zip(label_ranks,(nrows,ncols)):
+      cols = [read_array(f,KEY_TYPECODE,n) for x in range(max(rank,1))]
+      labels.append(zip(*cols) if rank else list(cols[0]))
+    try:
+      fileno = f.fileno()
+    except (AttributeError,IOError):
+      mapped = False
+    mapped = mapped and sys.byteorder == 'little'
+    if mapped:
+      mm = mmap.mmap(fileno,0,access=mmap.ACCESS_COPY)
+      offset = f.tell()
+      self.indptr = map_array(mm,offset,ROW_TYPECODE,nrows+1)
+      offset += (nrows+1)*array(ROW_TYPECODE).itemsize
+      self.indices = map_array(mm,offset,ROW_TYPECODE,nnz)
+      self.data = map_array(mm,val_offset,VAL_TYPECODE,nnz)
+    else:
+      self.indptr = read_array(f,ROW_TYPECODE,nrows+1)
+      self.indices = read_array(f,ROW_TYPECODE,nnz)
+      f.seek(val_offset)
+      self.data = read_array(f,VAL_TYPECODE,nnz)
+    f.seek(val_offset+nnz*array(VAL_TYPECODE).itemsize)
+    self.rows, self.cols = labels
+    self.row_ids = dict([(x,i) for i, x in enumerate(self.rows)])
+    self.csc = None
+    if indexed:
+      self.csc = CSRMatrix()
+      self.csc.from_bin(f,mapped=mapped)
+    if f != filename:
+      f.close()
 
 if __name__ == "__main__":
-  # @TODO - add some testing stuff?
-  pass
+  action = 'bench_index'
+  if len(sys.argv) > 1:
+    action = sys.argv[1].lower()
+  if action == 'bench_index':
+    # timing the index construction for random rank-4 tensors of growing size
+    # (a linear build keeps the time per entry roughly constant)
+    print 'Index build times (entries, seconds, microseconds per entry):'
+    for size in [25000,50000,100000,200000,400000,800000]:
+      t = Tensor(rank=4)
+      for key in sorted(set([tuple([random.randint(0,size/10) for x in \
+      range(4)]) for y in xrange(size)])):
+        t[key] = random.random()
+      start = time.time()
+      t.index()
+      end = time.time()
+      print '  %8d  %8.3f  %6.2f' % (len(t),end-start,\
+        (end-start)*10**6/len(t))
+  else:
+    print 'Unknown action, try again'